@@ -1,11 +1,49 @@
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from modules.utils import json_loads
 
-def scan_library_for_books(server_url: str, library_id: str, abs_api_token: str, log_file=None) -> requests.Response:
+# A single pooled session lets every call to the AudioBookShelf server reuse the
+# same keep-alive connection instead of paying a new TCP/TLS handshake per request.
+_SESSION = requests.Session()
+# Rate limiting (429) and transient gateway errors are retried with exponential backoff,
+# honouring Retry-After, so requests only wait when the server asks them to. The match and
+# scan POSTs are safe to repeat, so they are retried as well. Once the retries run out the
+# last response is returned rather than raised, so callers handle it like any other status.
+_RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods={"GET", "POST"},
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=_RETRY)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+# Number of match requests allowed in flight at once; kept below pool_maxsize
+_MATCH_WORKERS = 4
+# Number of failed titles listed in the summary notification
+_NOTIFY_MAX_TITLES = 10
+# Upper bound on how long to wait for a library scan to finish, and how often to check on it
+_SCAN_TIMEOUT_SECONDS = 15
+_SCAN_POLL_INTERVAL_SECONDS = 1
+
+
+def scan_library_for_books(
+    server_url: str,
+    library_id: str,
+    abs_api_token: str,
+    log_file=None,
+    session: requests.Session | None = None,
+) -> requests.Response:
     """
     Scan the library for books using the provided server URL, library ID, and API token.
 
@@ -13,13 +51,15 @@ def scan_library_for_books(server_url: str, library_id: str, abs_api_token: str,
         server_url (str): The base URL of the server.
         library_id (str): The unique identifier of the library.
         abs_api_token (str): The authentication token for API access.
+        session (requests.Session): Optional session to send the request with (defaults to the shared session).
 
     Returns:
         requests.Response: The response object containing the scan results.
     """
+    session = session or _SESSION
     if log_file:
         log_file.write("Starting the scan of Audio Book Shelf...\n")
-    response = requests.post(
+    response = session.post(
         f"{server_url}/api/libraries/{library_id}/scan",
         headers={"Authorization": f"Bearer {abs_api_token}"},
     )
@@ -28,7 +68,87 @@ def scan_library_for_books(server_url: str, library_id: str, abs_api_token: str,
     return response
 
 
-def get_all_books(server_url: str, library_id: str, abs_api_token: str, log_file=None) -> requests.Response:
+def get_library_last_scan(
+    server_url: str,
+    library_id: str,
+    abs_api_token: str,
+    session: requests.Session | None = None,
+) -> int | None:
+    """
+    Retrieve the timestamp of the most recent scan of the library.
+
+    Args:
+        server_url (str): The base URL of the server.
+        library_id (str): The unique identifier of the library.
+        abs_api_token (str): The authentication token for API access.
+        session (requests.Session): Optional session to send the request with (defaults to the shared session).
+
+    Returns:
+        int | None: The lastScan value in epoch milliseconds, or None if the server did not report one.
+    """
+    session = session or _SESSION
+    try:
+        response = session.get(
+            f"{server_url}/api/libraries/{library_id}",
+            headers={"Authorization": f"Bearer {abs_api_token}"},
+        )
+    except requests.RequestException:
+        return None
+    if not response.ok:
+        return None
+    return json_loads(response.content).get("lastScan")
+
+
+def wait_for_library_scan(
+    server_url: str,
+    library_id: str,
+    abs_api_token: str,
+    previous_scan: int | None,
+    log_file=None,
+    timeout: float = _SCAN_TIMEOUT_SECONDS,
+    poll_interval: float = _SCAN_POLL_INTERVAL_SECONDS,
+    session: requests.Session | None = None,
+) -> bool:
+    """
+    Wait until the library reports a scan newer than previous_scan, or until the timeout expires.
+
+    Args:
+        server_url (str): The base URL of the server.
+        library_id (str): The unique identifier of the library.
+        abs_api_token (str): The authentication token for API access.
+        previous_scan (int | None): The lastScan value read before the scan was started. If it could not be read,
+            the first value seen afterwards is used instead, since that may still be the old scan.
+        timeout (float): Maximum number of seconds to wait.
+        poll_interval (float): Number of seconds between checks.
+        session (requests.Session): Optional session to send the request with (defaults to the shared session).
+
+    Returns:
+        bool: True if the scan was seen to complete, False if the timeout expired first.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        last_scan = get_library_last_scan(server_url, library_id, abs_api_token, session)
+        if previous_scan is None:
+            previous_scan = last_scan
+        elif last_scan is not None and last_scan != previous_scan:
+            if log_file:
+                log_file.write("Audio Book Shelf scan completed\n")
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if log_file:
+                log_file.write(f"Audio Book Shelf scan did not report completion within {timeout} seconds\n")
+            return False
+        time.sleep(min(poll_interval, remaining))
+
+
+def get_all_books(
+    server_url: str,
+    library_id: str,
+    abs_api_token: str,
+    log_file=None,
+    session: requests.Session | None = None,
+) -> list[dict]:
     """
     Retrieve all books from the specified library using the provided server URL, library ID, and API token.
 
@@ -36,102 +156,181 @@ def get_all_books(server_url: str, library_id: str, abs_api_token: str, log_file
         server_url (str): The base URL of the server.
         library_id (str): The unique identifier of the library.
         abs_api_token (str): The authentication token for API access.
+        session (requests.Session): Optional session to send the request with (defaults to the shared session).
 
     Returns:
-        requests.Response: The response object containing all book items.
+        list[dict]: The library items, in the order they were added.
+
+    Raises:
+        requests.HTTPError: If the server did not return the library listing.
     """
+    session = session or _SESSION
     if log_file:
         log_file.write("Fetching the library from Audio BookShelf...\n")
-    return requests.get(
+    # The full library listing is large, verbose JSON, so ask for it compressed explicitly;
+    # urllib3 decompresses the body transparently
+    response = session.get(
         f"{server_url}/api/libraries/{library_id}/items?sort=addedAt",
-        headers={"Authorization": f"Bearer {abs_api_token}"},
+        headers={"Authorization": f"Bearer {abs_api_token}", "Accept-Encoding": "gzip, deflate"},
     )
+    response.raise_for_status()
+    # Decode the listing once here, so callers work with plain lists and the response buffer
+    # (several megabytes for a large library) can be freed straight away
+    return json_loads(response.content)["results"]
 
 
 def get_audio_bookshelf_recent_books(
-    json_response: requests.Response,
+    results: list[dict],
     log_file=None,
     days_ago: int = 0,
-    book_list: list = [],
+    book_list: list[dict] | None = None,
 ) -> list[dict]:
     """
-    Filter recent audio books from the provided JSON response based on the number of days ago.
+    Filter recent audio books from the library items based on the number of days ago.
 
     Args:
-        json_response (requests.Response): The response object containing book data.
+        results (list[dict]): The library items returned by get_all_books.
         days_ago (int): Number of days to consider as "recent" (default is 0)
-        book_list (list): A list of book titles
+        book_list (list[dict]): Optional list of processed books to look up instead of using days_ago
 
     Returns:
         list[dict]: A list of dictionaries representing recent audio books.
     """
+    if book_list is None:
+        book_list = ()
     # If we get a book_list with items, we want to only update those items
     # and not all items in the last N days
     if book_list:
         days_ago = 0
     if days_ago > 0:
         target_date = (datetime.now(timezone.utc) - timedelta(days=days_ago)).date()
+        # addedAt is in epoch milliseconds, so compare it against the start of the target day
+        # as an integer rather than building a datetime for every item
+        cutoff_ms = int(datetime.combine(target_date, datetime.min.time(), tzinfo=timezone.utc).timestamp() * 1000)
         if log_file:
             log_file.write(f"Getting the list of books from the last {days_ago} days\n")
-        recent_items = [
-            item
-            for item in json_response.json()["results"]
-            if datetime.fromtimestamp(item["addedAt"] / 1000, timezone.utc).date() >= target_date
-        ]
+        recent_items = [item for item in results if item["addedAt"] >= cutoff_ms]
     else:
         recent_items = []
+        # Group the library by title once so each requested book only scans the distinct titles;
+        # each item keeps its position so matches are returned in the library's order
+        items_by_title: dict[str, list[tuple[int, dict]]] = {}
+        for index, item in enumerate(results):
+            items_by_title.setdefault(item["media"]["metadata"]["title"], []).append((index, item))
         for book in book_list:
             if log_file:
                 log_file.write(f"Fetching {book} information from Audio BookShelf\n")
-            for item in json_response.json()["results"]:
-                if book["title"] in item["media"]["metadata"]["title"]:
-                    # Update the nested 'asin' key with the book's asin
-                    item["media"]["metadata"]["asin"] = book["asin"]
-                    recent_items.append(item)
+            matches = sorted(
+                indexed_item
+                for title, indexed_items in items_by_title.items()
+                if book["title"] in title
+                for indexed_item in indexed_items
+            )
+            for _, item in matches:
+                # Update the nested 'asin' key with the book's asin
+                item["media"]["metadata"]["asin"] = book["asin"]
+                recent_items.append(item)
     return recent_items
 
 
-def process_audio_books(todays_items: list[dict], server_url: str, abs_api_token: str, log_file) -> list[dict]:
+def _notify(summary: str, body: str) -> None:
+    """
+    Fire off a desktop notification without waiting for notify-send to exit.
+
+    Args:
+        summary (str): The notification summary line.
+        body (str): The notification body text.
+    """
+    subprocess.Popen(
+        ["notify-send", summary, body],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+    )
+
+
+def _match_one(item: dict, session: requests.Session, server_url: str, abs_api_token: str) -> dict:
+    """
+    Ask the server to match a single audio book item against the Audible provider.
+
+    Args:
+        item (dict): The AudioBookShelf library item to match.
+        session (requests.Session): The session to send the request with.
+        server_url (str): The base URL of the server.
+        abs_api_token (str): The authentication token for API access.
+
+    Returns:
+        dict: The item, the response body and whether the request succeeded.
+        Only successful responses are decoded as JSON; failures keep the status code and raw text.
+    """
+    match_payload = {
+        "author": item["media"]["metadata"]["authorName"],
+        "provider": "audible",
+        "asin": item["media"]["metadata"]["asin"],
+        "title": item["media"]["metadata"]["title"],
+        "overrideDefaults": "true",
+    }
+    api_url = f"{server_url}/api/items/{item['id']}/match"
+    output = session.post(
+        api_url,
+        json=match_payload,
+        headers={"Authorization": f"Bearer {abs_api_token}"},
+    )
+    if output.ok:
+        response = json_loads(output.content)
+    else:
+        response = {"status_code": output.status_code, "error": output.text}
+    return {"item": item, "response": response, "ok": output.ok}
+
+
+def process_audio_books(
+    todays_items: list[dict],
+    server_url: str,
+    abs_api_token: str,
+    log_file,
+    session: requests.Session | None = None,
+    max_workers: int = _MATCH_WORKERS,
+) -> list[dict]:
     """
     Process each audio book item by attempting to match it with the server.
+    Matches are sent concurrently, with at most max_workers requests in flight.
 
     Args:
         todays_items (list[dict]): List of dictionaries containing today's audio book items.
         server_url (str): The base URL of the server.
         abs_api_token (str): The authentication token for API access.
+        session (requests.Session): Optional session to send the requests with (defaults to the shared session).
+        max_workers (int): Maximum number of match requests to run at the same time.
+
+    Returns:
+        list[dict]: The decoded match responses, in the same order as todays_items.
     """
+    session = session or _SESSION
     results = []
-    for item in todays_items:  # Check last 5 items
-        match_payload = {
-            "author": item["media"]["metadata"]["authorName"],
-            "provider": "audible",
-            "asin": item["media"]["metadata"]["asin"],
-            "title": item["media"]["metadata"]["title"],
-            "overrideDefaults": "true",
-        }
-        api_url = f"{server_url}/api/items/{item['id']}/match"
-        output = requests.post(
-            api_url,
-            json=match_payload,
-            headers={"Authorization": f"Bearer {abs_api_token}"},
+    matched_count = 0
+    error_titles = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        matches = executor.map(
+            lambda item: _match_one(item, session, server_url, abs_api_token),
+            todays_items,
         )
-        results.append(output.json())
-        if output.ok:
-            log_file.write(f"Finished Matching {item["media"]["metadata"]["title"]} using the Audible Provider")
-            subprocess.run(
-                [
-                    "notify-send",
-                    "Audio Bookself",
-                    f"Processing {item['media']['metadata']['title']}",
-                ]
-            )
-        else:
-            subprocess.run(
-                [
-                    "notify-send",
-                    "Error",
-                    f"Error with {item['media']['metadata']['title']}",
-                ]
-            )
-        time.sleep(2)
+        # Logging stays on this thread so the log file is only written from one place
+        for match in matches:
+            title = match["item"]["media"]["metadata"]["title"]
+            results.append(match["response"])
+            if match["ok"]:
+                log_file.write(f"Finished Matching {title} using the Audible Provider\n")
+                matched_count += 1
+            else:
+                error_titles.append(title)
+
+    # One summary notification for the whole run instead of one per book
+    if error_titles:
+        _notify(
+            "Error",
+            f"Matched {matched_count} books; {len(error_titles)} errors:\n"
+            + "\n".join(error_titles[:_NOTIFY_MAX_TITLES]),
+        )
+    elif matched_count:
+        _notify("Audio Bookself", f"Matched {matched_count} books")
     return results
@@ -1,4 +1,5 @@
 import argparse
+import functools
 import logging
 import sys
 import typing as t
@@ -9,10 +10,16 @@ import yaml
 LOGGER = logging.getLogger(__name__)
 _IS_TEST: bool = False
 
+# Use the libyaml C implementation when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
+
+@functools.lru_cache(maxsize=1)
 def _get_parser() -> argparse.ArgumentParser:
     """Create ArguementParser object and add arguements to it.
     This is separated into its own function to increase readability.
+    The parser is built once and reused, since parse_args does not modify it.
 
     Returns:
         argparse.ArgumentParser: ArgumentParser object configured for all cli options.
@@ -83,6 +90,14 @@ def _get_parser() -> argparse.ArgumentParser:
         help="Copy files instead of moving them (useful for debugging/testing)",
     )
 
+    parser.add_argument(
+        "--allow-hardlinks",
+        dest="allow_hardlinks",
+        default=False,
+        action="store_true",
+        help="With --copy-instead-of-move, hard link files instead of copying them when on the same filesystem",
+    )
+
     parser.add_argument(
         "--libation-folder-cleanup",
         dest="libation_folder_cleanup",
@@ -99,6 +114,14 @@ def _get_parser() -> argparse.ArgumentParser:
         help="Path to Libation's FileLocationsV2.json file (optional, uses constructed paths if not provided)",
     )
 
+    parser.add_argument(
+        "--processed-cache-path",
+        dest="processed_cache_path",
+        type=str,
+        default="",
+        help="Record transferred books in this file and skip unchanged downloads on later runs (off when empty)",
+    )
+
     parser.add_argument(
         "--library-id",
         dest="library_id",
@@ -136,6 +159,12 @@ def _get_parser() -> argparse.ArgumentParser:
     return parser
 
 
+# Option names written by generate_yaml_from_parser, read straight from the parser's actions
+_YAML_EXPORT_DESTS = tuple(
+    action.dest for action in _get_parser()._actions if action.dest not in ("help", "yaml", "generate_yaml")
+)
+
+
 def _parse_fail(msg: str) -> None:
     LOGGER.error(msg)
     _get_parser().print_help(sys.stderr)
@@ -144,8 +173,7 @@ def _parse_fail(msg: str) -> None:
 
 class Config:
     def __init__(self: t.Self, **kwargs: t.Any) -> None:
-        for name in kwargs:
-            setattr(self, name, kwargs[name])
+        self.__dict__.update(kwargs)
 
     def __contains__(self: t.Self, key: str) -> bool:
         return key in self.__dict__
@@ -186,12 +214,13 @@ class Config:
         """
         try:
             with open(self.yaml, "r") as yaml_file:
-                config_dict = yaml.safe_load(yaml_file)
+                config_dict = yaml.load(yaml_file, Loader=_YAML_LOADER)
                 # Convert dash-separated keys to underscore-separated keys
+                translated = {}
                 for key, value in config_dict.items():
                     new_key = key.replace("-", "_")
-                    new_value = Path(value) if new_key == "file" else value
-                    setattr(self, new_key, new_value)
+                    translated[new_key] = Path(value) if new_key == "file" else value
+                self.__dict__.update(translated)
             delattr(self, "yaml")
 
         except FileNotFoundError:
@@ -230,17 +259,18 @@ class Config:
         
         # books_json_path is only required for non-Libation or if file doesn't exist
         # For Libation, it will be auto-generated if missing
+        values = self.__dict__
         missing_errors = []
         for attr, error_msg in required.items():
-            # Use getattr with a default of None in case the attribute is missing
-            value = getattr(self, attr, None)
+            # Use get with a default of None in case the attribute is missing
+            value = values.get(attr)
             # Check that the attribute exists and is not an empty string (if applicable)
             if value is None or (isinstance(value, str) and value.strip() == ""):
                 missing_errors.append(error_msg)
         
         # Special handling for books_json_path
-        books_json = getattr(self, "books_json_path", None)
-        download_program = getattr(self, "download_program", "OpenAudible")
+        books_json = values.get("books_json_path")
+        download_program = values.get("download_program", "OpenAudible")
         
         # Only require books_json_path for OpenAudible or when explicitly set for Libation
         if download_program != "Libation":
@@ -254,6 +284,16 @@ class Config:
             if exit_on_error:
                 exit(1)
 
+    def _yaml_export_data(self: t.Self) -> dict:
+        """Collect the arguments written by generate_yaml_from_parser.
+
+        Returns:
+            dict: Every parser option except --yaml and --generate-yaml, in a format compatible with _load_yaml.
+        """
+        return {
+            attr: str(getattr(self, attr)) if attr == "file" else getattr(self, attr) for attr in _YAML_EXPORT_DESTS
+        }
+
     def generate_yaml_from_parser(self: t.Self, file_path: str | None = None) -> None:
         """
         Generate a YAML file containing all arguments from the given ArgumentParser.
@@ -264,15 +304,8 @@ class Config:
         """
         if file_path is None:
             file_path = "parser_arguments.yaml"
-        config_data_attributes = {}
-        for attr in _get_parser().parse_args(args=()).__dict__.keys():
-            if attr == "file":
-                config_data_attributes[attr] = str(getattr(self, attr))
-            elif attr in ["yaml", "generate_yaml"]:
-                continue
-            else:
-                config_data_attributes[attr] = getattr(self, attr)
+        config_data_attributes = self._yaml_export_data()
 
         # Write to YAML file
         with open(file_path, "w") as f:
-            yaml.dump(config_data_attributes, f, indent=2, sort_keys=False)
+            yaml.dump(config_data_attributes, f, Dumper=_YAML_DUMPER, indent=2, sort_keys=False)
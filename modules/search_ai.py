@@ -1,9 +1,110 @@
+import functools
 import json
-from typing import Any, Dict
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable
 
+import requests
 from openai import OpenAI
+from pydantic import BaseModel
 
+from modules.utils import json_loads
 
+# Reused across lookups so repeated calls to the same provider keep their connection alive
+_SESSION = requests.Session()
+
+_OPENAI_MODEL = "gpt-4"  # or "gpt-3.5-turbo"
+_PERPLEXITY_MODEL = "sonar"
+
+
+class _PerplexityAnswerFormat(BaseModel):
+    author: str
+    book_title: str
+    book_sequence_number: int
+    book_series_title: str
+
+
+# The response schema never changes, so it is generated once at import
+_PERPLEXITY_SCHEMA = _PerplexityAnswerFormat.model_json_schema()
+
+# Parsed lookup results are kept on disk so the same title is not paid for twice
+_CACHE_PATH = Path(os.path.expanduser("~/.cache/openaudible_ai.sqlite3"))
+_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def _cache_connect() -> sqlite3.Connection:
+    """Open the lookup cache, creating the database and table if needed."""
+    _CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(_CACHE_PATH)
+    connection.execute("CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, stored_at REAL, value TEXT)")
+    return connection
+
+
+def _cache_get(key: str) -> Dict[str, Any] | None:
+    """Return the cached result for key, or None if it is missing or expired."""
+    try:
+        with closing(_cache_connect()) as connection:
+            row = connection.execute("SELECT stored_at, value FROM lookups WHERE key = ?", (key,)).fetchone()
+    except (sqlite3.Error, OSError):
+        # The cache is only an optimization; an unusable cache (including an unwritable
+        # cache directory) behaves like an empty one
+        return None
+    if row is None or time.time() - row[0] > _CACHE_TTL_SECONDS:
+        return None
+    return json.loads(row[1])
+
+
+def _cache_set(key: str, value: Dict[str, Any]) -> None:
+    """Store a parsed lookup result in the cache."""
+    try:
+        with closing(_cache_connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO lookups (key, stored_at, value) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(value)),
+            )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def _cached_search(model: str) -> Callable:
+    """Cache a search function's parsed results on disk, keyed by function, model and title.
+
+    Args:
+        model: The model the search function queries, so changing models does not reuse old answers.
+
+    Returns:
+        A decorator for a search function taking (book_title, api_key).
+    """
+
+    def decorator(search: Callable[[str, str], Dict[str, Any]]) -> Callable[[str, str], Dict[str, Any]]:
+        @functools.wraps(search)
+        def wrapper(book_title: str, api_key: str) -> Dict[str, Any]:
+            key = f"{search.__name__}:{model}:{book_title.strip().lower()}"
+            cached = _cache_get(key)
+            if cached is not None:
+                return cached
+            result = search(book_title, api_key)
+            # Failed lookups are not cached so they are retried on the next run
+            if "error" not in result:
+                _cache_set(key, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def _get_openai_client(api_key: str) -> OpenAI:
+    """Return a shared OpenAI client for the given API key."""
+    return OpenAI(api_key=api_key)
+
+
+@_cached_search(_OPENAI_MODEL)
 def search_open_ai(book_title: str, api_key: str) -> Dict[str, Any]:
     """Searches for book information using OpenAI API.
 
@@ -13,9 +114,10 @@ def search_open_ai(book_title: str, api_key: str) -> Dict[str, Any]:
 
     Returns:
         A json (dictionary) data structure containing book information.
+        Successful results are cached on disk for 30 days.
     """
 
-    client = OpenAI(api_key=api_key)
+    client = _get_openai_client(api_key)
     messages = [
         {
             "role": "system",
@@ -37,7 +139,7 @@ def search_open_ai(book_title: str, api_key: str) -> Dict[str, Any]:
     ]
 
     response = client.chat.completions.create(
-        model="gpt-4",  # or "gpt-3.5-turbo"
+        model=_OPENAI_MODEL,
         messages=messages,
         max_tokens=300,
         temperature=0,
@@ -46,12 +148,13 @@ def search_open_ai(book_title: str, api_key: str) -> Dict[str, Any]:
     reply = response.choices[0].message.content
 
     try:
-        result = json.loads(reply.strip())
+        result = json_loads(reply.strip())
         return result
     except json.JSONDecodeError:
         return {"error": "Failed to parse JSON from API response"}
 
 
+@_cached_search(_PERPLEXITY_MODEL)
 def search_perplexity(book_title: str, api_key: str) -> Dict[str, Any]:
     """Searches for book information using Perplexity AI API.
 
@@ -61,20 +164,12 @@ def search_perplexity(book_title: str, api_key: str) -> Dict[str, Any]:
 
     Returns:
         A json (dictionary) data structure containing book information.
+        Successful results are cached on disk for 30 days.
     """
-    import requests
-    from pydantic import BaseModel
-
-    class AnswerFormat(BaseModel):
-        author: str
-        book_title: str
-        book_sequence_number: int
-        book_series_title: str
-
     url = "https://api.perplexity.ai/chat/completions"
     headers = {"Authorization": f"Bearer {api_key}"}
     payload = {
-        "model": "sonar",
+        "model": _PERPLEXITY_MODEL,
         "messages": [
             {
                 "role": "system",
@@ -91,8 +186,31 @@ def search_perplexity(book_title: str, api_key: str) -> Dict[str, Any]:
         ],
         "response_format": {
             "type": "json_schema",
-            "json_schema": {"schema": AnswerFormat.model_json_schema()},
+            "json_schema": {"schema": _PERPLEXITY_SCHEMA},
         },
     }
-    response = requests.post(url, headers=headers, json=payload).json()
-    return json.loads(response["choices"][0]["message"]["content"])
+    response = json_loads(_SESSION.post(url, headers=headers, json=payload).content)
+    return json_loads(response["choices"][0]["message"]["content"])
+
+
+def search_books(
+    book_titles: Iterable[str],
+    api_key: str,
+    search: Callable[[str, str], Dict[str, Any]] = search_perplexity,
+    max_workers: int = 4,
+) -> Dict[str, Dict[str, Any]]:
+    """Looks up several books at once, running the provider requests concurrently.
+
+    Args:
+        book_titles: The titles of the books to search for.
+        api_key: The API key for the chosen provider.
+        search: The lookup function to use, either search_perplexity or search_open_ai.
+        max_workers: Maximum number of lookups to run at the same time.
+
+    Returns:
+        A dictionary mapping each book title to the information returned for it.
+    """
+    titles = list(dict.fromkeys(book_titles))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda title: search(title, api_key), titles)
+        return dict(zip(titles, results))
@@ -1,8 +1,32 @@
+import errno
+import functools
 import os
+import re
+import shutil
 import subprocess
 from datetime import datetime
 from pathlib import Path
 
+# orjson is optional; the standard library parser accepts the same str/bytes input
+try:
+    from orjson import dumps as json_dumps
+    from orjson import loads as json_loads
+except ImportError:
+    import json
+    from json import loads as json_loads  # noqa: F401
+
+    def json_dumps(obj) -> bytes:
+        """Serialize obj to UTF-8 JSON bytes, matching orjson.dumps."""
+        return json.dumps(obj).encode()
+
+
+# Commas are dropped and spaces become underscores before filtering
+_SANITIZE_TRANS = str.maketrans({",": None, " ": "_"})
+# \w matches the same characters as str.isalnum() plus the underscore
+_SANITIZE_RE = re.compile(r"[^\w.]")
+# ISO-8601 timestamps always start with the calendar date
+_DATE_PREFIX_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})")
+
 
 def _parse_date(date_str: str) -> str:
     """
@@ -14,6 +38,12 @@ def _parse_date(date_str: str) -> str:
     Returns:
         str: The parsed date string in YYYY-MM-DD format.
     """
+    # The date is written before any time, fraction or offset, so when it is
+    # present it can be returned as is without building a datetime
+    match = _DATE_PREFIX_RE.match(date_str)
+    if match:
+        return match.group(1)
+
     # The UTC designation is not important to the purchase date so
     # remove it if it exists
     if date_str.endswith("Z"):
@@ -49,14 +79,59 @@ def make_directory_structure(author_dir: str, series_dir: str, book_title_dir: s
     if series_dir:
         audio_book_destination_dir = os.path.join(audio_book_destination_dir, series_dir)
     audio_book_destination_dir = os.path.join(audio_book_destination_dir, book_title_dir)
-    if not os.path.exists(audio_book_destination_dir):
-        os.makedirs(audio_book_destination_dir)
+    os.makedirs(audio_book_destination_dir, exist_ok=True)
     return audio_book_destination_dir
 
 
+def move_file(source_path: str, target_path: str) -> None:
+    """
+    Move a file, replacing any existing file at the target.
+
+    When both paths are on the same filesystem this is a single atomic rename;
+    otherwise it falls back to shutil.move, which copies the data and removes the source.
+
+    Args:
+        source_path (str): The file to move.
+        target_path (str): The full destination file path.
+    """
+    try:
+        os.replace(source_path, target_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, target_path)
+
+
+def copy_file(source_path: str, target_path: str, allow_hardlinks: bool = False) -> str:
+    """
+    Copy a file, replacing any existing file at the target.
+
+    Args:
+        source_path (str): The file to copy.
+        target_path (str): The full destination file path.
+        allow_hardlinks (bool): Try a hard link first, which shares the data instead of copying it.
+
+    Returns:
+        str: "hardlinked" if a hard link was created, otherwise "copied".
+    """
+    if allow_hardlinks:
+        try:
+            if os.path.lexists(target_path):
+                os.unlink(target_path)
+            os.link(source_path, target_path)
+            return "hardlinked"
+        except OSError:
+            # Different filesystems or no hard link support, so copy the data instead
+            pass
+    shutil.copy2(source_path, target_path)
+    return "copied"
+
+
+@functools.lru_cache(maxsize=4096)
 def sanitize_name(name: str) -> str:
     """
     Sanitize a name by replacing commas with underscores and spaces with single underscores.
+    Results are cached, since the same author and series names repeat across a library.
 
     Args:
         name (str): The input name to sanitize.
@@ -64,9 +139,7 @@ def sanitize_name(name: str) -> str:
     Returns:
         str: The sanitized name.
     """
-    name_without_commas = name.replace(",", "")
-    name_with_underscores = name_without_commas.replace(" ", "_")
-    sanitized = "".join([c for c in name_with_underscores if c.isalnum() or c in ("_", ".")])
+    sanitized = _SANITIZE_RE.sub("", name.translate(_SANITIZE_TRANS))
     return sanitized.rstrip()
 
 
@@ -82,15 +155,15 @@ def generate_libation_json(output_path: str, log_file) -> bool:
         bool: True if the export was successful, False otherwise.
     """
     try:
-        from datetime import datetime
-
         log_file.write(f"{datetime.now()} - INFO - Generating libation.json using libationcli...\n")
         log_file.flush()
 
-        # Run libationcli export command
+        # Run libationcli export command. The export is written to output_path,
+        # so stdout is discarded and only stderr is kept for the error log
         result = subprocess.run(
             ["libationcli", "export", "--path", output_path, "--json"],
-            capture_output=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             text=True,
             check=False,
         )
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
+import functools
 import json
 import os
 import shutil
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
-from modules.audio_bookshelf import (get_all_books, get_audio_bookshelf_recent_books, process_audio_books,
-                                     scan_library_for_books)
+from modules.audio_bookshelf import (get_all_books, get_audio_bookshelf_recent_books, get_library_last_scan,
+                                     process_audio_books, scan_library_for_books, wait_for_library_scan)
 from modules.config import Config
-from modules.utils import _parse_date, generate_libation_json, make_directory_structure, sanitize_name
+from modules.utils import (_parse_date, copy_file, generate_libation_json, json_dumps, json_loads,
+                           make_directory_structure, move_file, sanitize_name)
+
+# The log is written to many times per book; a larger buffer batches those into fewer writes
+_LOG_BUFFER_SIZE = 1 << 16
+# Number of books moved or copied at once; file transfers spend their time waiting on the disk
+_TRANSFER_WORKERS = 4
 
 
 def process_open_audible_book_json(book_data: dict) -> dict:
@@ -103,6 +110,185 @@ def process_libation_book_json(book_data: dict, file_locations: dict = None) ->
     return result
 
 
+def _open_audible_source_paths(book_data: dict, source_dir: str, audio_file_name: str) -> tuple[str, str | None]:
+    """
+    Locate a downloaded OpenAudible book. OpenAudible keeps every book directly in source_dir.
+
+    Args:
+        book_data (dict): The standardized book dictionary.
+        source_dir (str): Source directory containing audio book files.
+        audio_file_name (str): The audio file name including its extension.
+
+    Returns:
+        tuple[str, str | None]: The downloaded file path and the per-book folder (always None for OpenAudible).
+    """
+    return os.path.join(source_dir, audio_file_name), None
+
+
+def _libation_source_paths(book_data: dict, source_dir: str, audio_file_name: str) -> tuple[str, str]:
+    """
+    Locate a downloaded Libation book and the folder Libation created for it.
+
+    Args:
+        book_data (dict): The standardized book dictionary.
+        source_dir (str): Source directory containing audio book files.
+        audio_file_name (str): The audio file name including its extension.
+
+    Returns:
+        tuple[str, str]: The downloaded file path and the book's folder, used for cleanup.
+    """
+    # Use file_path from FileLocationsV2.json if available
+    if "file_path" in book_data:
+        downloaded_audio_file_path = book_data["file_path"]
+        # Extract the directory for cleanup purposes
+        return downloaded_audio_file_path, os.path.dirname(downloaded_audio_file_path)
+    # Fall back to constructed path
+    libation_source_dir = source_dir + os.sep + book_data["libation_book_folder"]
+    return os.path.join(libation_source_dir, audio_file_name), libation_source_dir
+
+
+def _load_processed_books(cache_path: str) -> set[tuple]:
+    """
+    Read the set of books transferred on earlier runs.
+
+    Args:
+        cache_path (str): Path of the processed-books cache file.
+
+    Returns:
+        set[tuple]: (source path, mtime in ns, size, destination dir) for every transferred book.
+    """
+    try:
+        with open(cache_path, "rb") as file:
+            return {tuple(entry) for entry in json_loads(file.read())}
+    except (IOError, ValueError, TypeError):
+        # A missing or unreadable cache only means every book is looked at again
+        return set()
+
+
+def _save_processed_books(cache_path: str, processed_books: set[tuple]) -> None:
+    """
+    Write the processed-books cache, replacing the previous file atomically.
+
+    Args:
+        cache_path (str): Path of the processed-books cache file.
+        processed_books (set[tuple]): The entries to store.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    # A bare file name lives in the current directory, which already exists
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(json_dumps(sorted(processed_books)))
+    os.replace(temp_path, cache_path)
+
+
+def _transfer_book(
+    book_job: tuple,
+    destination_dir: str,
+    copy_instead_of_move: bool,
+    libation_folder_cleanup: bool,
+    allow_hardlinks: bool,
+    processed_books: frozenset[tuple] = frozenset(),
+) -> tuple[dict | None, list[str], tuple | None]:
+    """
+    Move or copy one book into the destination directory. Runs on a worker thread, so log lines are
+    returned to the caller instead of being written here.
+
+    Args:
+        book_job (tuple): The book data, its sanitized author/series/title directories, the audio file name,
+            the downloaded file path and the Libation folder (or None).
+        destination_dir (str): Destination directory for organized books
+        copy_instead_of_move (bool): If True, copy files instead of moving them
+        libation_folder_cleanup (bool): If True, delete source folders after moving
+        allow_hardlinks (bool): If True and copying, hard link files instead when possible
+        processed_books (frozenset[tuple]): Books transferred on earlier runs, which are skipped while their
+            library copy still exists
+
+    Returns:
+        tuple[dict | None, list[str], tuple | None]: The book data if it was transferred (otherwise None), its
+            log lines and, if it was transferred, its processed-books cache entry.
+    """
+    (
+        book_data,
+        author_dir,
+        series_dir,
+        book_title_dir,
+        audio_file_name,
+        downloaded_audio_file_path,
+        libation_source_dir,
+    ) = book_job
+    log_lines = []
+    try:
+        # One stat per file answers both "does it exist" and "how big is it"
+        try:
+            downloaded_file_stat = os.stat(downloaded_audio_file_path)
+        except FileNotFoundError:
+            return None, log_lines, None
+        processed_key = (
+            downloaded_audio_file_path,
+            downloaded_file_stat.st_mtime_ns,
+            downloaded_file_stat.st_size,
+            destination_dir,
+        )
+        audio_book_destination_dir = make_directory_structure(author_dir, series_dir, book_title_dir, destination_dir)
+        target_audio_file_path = os.path.join(audio_book_destination_dir, audio_file_name)
+        try:
+            existing_file_stat = os.stat(target_audio_file_path)
+        except FileNotFoundError:
+            existing_file_stat = None
+
+        # A cache hit is only trusted while the library copy is still there; otherwise it is restored
+        if processed_key in processed_books and existing_file_stat is not None:
+            log_lines.append(f"{datetime.now()} - INFO - Already processed: {book_data['title']}\n")
+            return None, log_lines, None
+        if existing_file_stat is not None:
+            existing_file_size = existing_file_stat.st_size
+            downloaded_file_size = downloaded_file_stat.st_size
+            if downloaded_file_size < existing_file_size:
+                log_lines.append(f"{datetime.now()} - INFO - No change for book: {book_data['title']}\n")
+                return None, log_lines, None
+            else:
+                log_lines.append(f"{book_data['title']} has an existing file but it will be replaced! \n")
+                log_lines.append(
+                    f"The downloaded file is larger ({downloaded_file_size}) than the existing file \
+                        ({existing_file_size}).\n"
+                )
+            log_lines.append(f"{datetime.now()} - INFO - Processing: {book_data['title']}\n")
+        # The source was stat'ed above; this only catches it vanishing in the meantime
+        try:
+            if copy_instead_of_move:
+                action = copy_file(downloaded_audio_file_path, target_audio_file_path, allow_hardlinks)
+            else:
+                move_file(downloaded_audio_file_path, target_audio_file_path)
+                action = "moved"
+        except FileNotFoundError:
+            log_lines.append(
+                f"{datetime.now()} - WARNING - Source file disappeared before it could be processed: "
+                f"{downloaded_audio_file_path}\n"
+            )
+            return None, log_lines, None
+        if libation_folder_cleanup and not copy_instead_of_move and libation_source_dir:
+            # The book is already in the library, so a leftover source folder must not drop it from the results
+            try:
+                shutil.rmtree(libation_source_dir)
+            except OSError as e:
+                log_lines.append(
+                    f"{datetime.now()} - WARNING - Could not remove the Libation folder {libation_source_dir}: {e}\n"
+                )
+        log_lines.append(
+            f"{datetime.now()} - INFO - Processed and {action} files for book: {book_data['title']} under \
+                '{author_dir}/{series_dir}'\n"
+        )
+        return book_data, log_lines, processed_key
+    except Exception as e:
+        log_lines.append(
+            f"{datetime.now()} - ERROR - An error occurred while processing {book_data.get('title', 'Unknown Book')}:"
+            f" {e}\n"
+        )
+        return None, log_lines, None
+
+
 def move_audio_book_files(
     audio_file_extension: str,
     books_json_path: str,
@@ -114,6 +300,9 @@ def move_audio_book_files(
     purchased_how_long_ago: int,
     source_dir: str,
     libation_file_locations_path: str = "",
+    allow_hardlinks: bool = False,
+    max_workers: int = _TRANSFER_WORKERS,
+    processed_cache_path: str = "",
 ) -> list:
     """
     This function reads the books JSON file, processes each book, and logs the results.
@@ -129,24 +318,26 @@ def move_audio_book_files(
         purchased_how_long_ago: Process books purchased within this many days
         source_dir: Source directory containing audio book files
         libation_file_locations_path: Optional path to Libation's FileLocationsV2.json
+        allow_hardlinks: If True and copying, hard link files instead when source and destination share a filesystem
+        max_workers: Number of books transferred at once
+        processed_cache_path: Optional path of a cache of books transferred on earlier runs, which are skipped
 
     Returns:
         list: List of processed books
     """
     try:
-        with open(books_json_path, "r") as file:
-            books: list[dict] = json.load(file)
+        with open(books_json_path, "rb") as file:
+            books: list[dict] = json_loads(file.read())
     except (IOError, json.JSONDecodeError) as e:
-
-        log_file.write(f"{datetime.now()} - Error reading JSON file: {e}")
-        exit(1)
+        log_file.write(f"{datetime.now()} - Error reading JSON file: {e}\n")
+        raise
 
     # Load file locations if provided (for Libation)
     file_locations = None
     if libation_file_locations_path and os.path.exists(libation_file_locations_path):
         try:
-            with open(libation_file_locations_path, "r") as file:
-                file_locations = json.load(file)
+            with open(libation_file_locations_path, "rb") as file:
+                file_locations = json_loads(file.read())
         except (IOError, json.JSONDecodeError) as e:
             log_file.write(f"{datetime.now()} - Warning: Could not read FileLocationsV2.json: {e}\n")
             log_file.write(f"{datetime.now()} - Will use constructed paths instead\n")
@@ -156,76 +347,84 @@ def move_audio_book_files(
         target_date = (datetime.now(timezone.utc) - timedelta(days=9125)).date()
     else:
         target_date = (datetime.now(timezone.utc) - timedelta(days=purchased_how_long_ago)).date()
-    books_to_process_in_audio_bookself = []
+    # Purchase dates are normalized to YYYY-MM-DD, which sorts the same way as the dates themselves
+    target_date_str = target_date.isoformat()
+    # Pick the download program's parser and path lookup once rather than for every book
+    if download_program == "OpenAudible":
+        process_book_json = process_open_audible_book_json
+        find_source_paths = _open_audible_source_paths
+    else:
+        process_book_json = functools.partial(process_libation_book_json, file_locations=file_locations)
+        find_source_paths = _libation_source_paths
+    # Working out which books to transfer is cheap, so it is done up front; the disk-bound stat, copy and
+    # move work for each book is then spread over a thread pool
+    book_jobs = []
     for book in books:
         try:
-            if download_program == "OpenAudible":
-                book_data = process_open_audible_book_json(book)
-            else:
-                book_data = process_libation_book_json(book, file_locations)
+            book_data = process_book_json(book)
 
             purchase_date = book_data["purchase_date"]
             # we don't want to process books in the library older than a specific date
             # it's too intensive
-            if datetime.strptime(purchase_date, "%Y-%m-%d").date() < target_date:
+            if purchase_date < target_date_str:
                 continue
             author_dir = sanitize_name(book_data["author"])
             series_dir = sanitize_name(book_data["series"]) if book_data["series"] else ""
             book_title_dir = sanitize_name(book_data["title"])
             audio_file_name = book_data["filename"] + audio_file_extension
 
-            if download_program == "OpenAudible":
-                downloaded_audio_file_path = os.path.join(source_dir, audio_file_name)
-            else:
-                # Use file_path from FileLocationsV2.json if available
-                if "file_path" in book_data:
-                    downloaded_audio_file_path = book_data["file_path"]
-                    # Extract the directory for cleanup purposes
-                    libation_source_dir = os.path.dirname(downloaded_audio_file_path)
-                else:
-                    # Fall back to constructed path
-                    libation_source_dir = source_dir + os.sep + book_data["libation_book_folder"]
-                    downloaded_audio_file_path = os.path.join(libation_source_dir, audio_file_name)
-
-            if not (os.path.exists(downloaded_audio_file_path)):
-                continue
-            audio_book_destination_dir = make_directory_structure(
-                author_dir, series_dir, book_title_dir, destination_dir
-            )
-            target_audio_file_path = os.path.join(audio_book_destination_dir, audio_file_name)
-
-            if os.path.exists(target_audio_file_path):
-                existing_file_size = os.path.getsize(target_audio_file_path)
-                downloaded_file_size = os.path.getsize(downloaded_audio_file_path)
-                if downloaded_file_size < existing_file_size:
-                    log_file.write(f"{datetime.now()} - INFO - No change for book: {book_data['title']}\n")
-                    continue
-                else:
-                    log_file.write(f"{book_data['title']} has an existing file but it will be replaced! \n")
-                    log_file.write(
-                        f"The downloaded file is larger ({downloaded_file_size}) than the existing file \
-                            ({existing_file_size}).\n"
-                    )
-                print(f"Processing: {book_data['title']}")
-                log_file.write(f"{datetime.now()} - INFO - Processing: {book_data['title']}\n")
-            books_to_process_in_audio_bookself.append(book_data)
-            if os.path.exists(downloaded_audio_file_path):
-                if copy_instead_of_move:
-                    shutil.copy2(downloaded_audio_file_path, audio_book_destination_dir)
-                    action = "copied"
-                else:
-                    shutil.move(downloaded_audio_file_path, audio_book_destination_dir)
-                    action = "moved"
-            if libation_folder_cleanup and not copy_instead_of_move:
-                shutil.rmtree(libation_source_dir)
-            log_file.write(
-                f"{datetime.now()} - INFO - Processed and {action} files for book: {book_data['title']} under \
-                    '{author_dir}/{series_dir}'\n"
+            downloaded_audio_file_path, libation_source_dir = find_source_paths(book_data, source_dir, audio_file_name)
+            # The file keeps its own name in the library; a path from FileLocationsV2.json can differ from the
+            # constructed one (Libation's naming templates are configurable, and so is the file type)
+            audio_file_name = os.path.basename(downloaded_audio_file_path)
+            book_jobs.append(
+                (
+                    book_data,
+                    author_dir,
+                    series_dir,
+                    book_title_dir,
+                    audio_file_name,
+                    downloaded_audio_file_path,
+                    libation_source_dir,
+                )
             )
         except Exception as e:
             error_title = book_data.get("title", "Unknown Book") if "book_data" in locals() else "Unknown Book"
             log_file.write(f"{datetime.now()} - ERROR - An error occurred while processing {error_title}: {e}\n")
 
+    # The suggested default lives under ~/.cache, so a leading ~ is expanded the way a shell would
+    processed_cache_path = os.path.expanduser(processed_cache_path)
+    loaded_books = frozenset(_load_processed_books(processed_cache_path)) if processed_cache_path else frozenset()
+    processed_books = set(loaded_books)
+    transfer_book = functools.partial(
+        _transfer_book,
+        processed_books=loaded_books,
+        destination_dir=destination_dir,
+        copy_instead_of_move=copy_instead_of_move,
+        libation_folder_cleanup=libation_folder_cleanup,
+        allow_hardlinks=allow_hardlinks,
+    )
+    books_to_process_in_audio_bookself = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map keeps the input order, so the log reads the same as when books were processed one at a time
+        for book_data, log_lines, processed_key in executor.map(transfer_book, book_jobs):
+            log_file.writelines(log_lines)
+            if book_data is not None:
+                books_to_process_in_audio_bookself.append(book_data)
+                processed_books.add(processed_key)
+    if processed_cache_path:
+        # Entries whose download is gone (every moved book, or a deleted download) can never match again
+        current_books = {entry for entry in processed_books if os.path.exists(entry[0])}
+        if current_books != loaded_books:
+            # The books have already been transferred, so a cache that cannot be written must not stop the run
+            try:
+                _save_processed_books(processed_cache_path, current_books)
+            except OSError as e:
+                log_file.write(
+                    f"{datetime.now()} - WARNING - Could not write the processed-books cache {processed_cache_path}: "
+                    f"{e}\n"
+                )
+
     return books_to_process_in_audio_bookself
 
 
@@ -236,74 +435,77 @@ def main(*args: str):
         args.generate_yaml_from_parser(file_path="/tmp/arguments.yaml")
         exit()
     try:
-        log_file = open(args.log_file_path, "a")
+        log_file = open(args.log_file_path, "a", buffering=_LOG_BUFFER_SIZE)
     except IOError as e:
         print(f"Error opening log file: {e}")
         exit(1)
 
-    # Auto-generate libation.json if using Libation and the file doesn't exist
-    if args.download_program == "Libation" and not os.path.exists(args.books_json_path):
-        log_file.write(
-            f"{datetime.now()} - INFO - Libation JSON file not found at {args.books_json_path}. "
-            "Attempting to generate it...\n"
-        )
-        log_file.flush()
-
-        # If books_json_path is the default OpenAudible path, use source-audio-book-directory instead
-        if "OpenAudible" in args.books_json_path:
-            args.books_json_path = os.path.join(args.source_audio_book_directory, "libation.json")
+    # The log file is closed on every exit path, including errors raised while processing books
+    with log_file:
+        # Auto-generate libation.json if using Libation and the file doesn't exist
+        if args.download_program == "Libation" and not os.path.exists(args.books_json_path):
             log_file.write(
-                f"{datetime.now()} - INFO - Using source audio book directory for libation.json: "
-                f"{args.books_json_path}\n"
+                f"{datetime.now()} - INFO - Libation JSON file not found at {args.books_json_path}. "
+                "Attempting to generate it...\n"
             )
             log_file.flush()
 
-        success = generate_libation_json(args.books_json_path, log_file)
-        if not success:
-            log_file.write(
-                f"{datetime.now()} - ERROR - Failed to generate libation.json. "
-                "Please generate it manually using: "
-                f"libationcli export --path {args.books_json_path} --json\n"
-            )
-            log_file.close()
-            print(
-                f"ERROR: Failed to auto-generate libation.json. "
-                f"Please run: libationcli export --path {args.books_json_path} --json"
-            )
-            exit(1)
-
-    # This will process any files in the OpenAudible directory that is 7 days or newer
-    # According to current date as compared to the purchase date
-    book_list = move_audio_book_files(
-        args.audio_file_extension,
-        args.books_json_path,
-        args.copy_instead_of_move,
-        args.destination_book_directory,
-        args.download_program,
-        args.libation_folder_cleanup,
-        log_file,
-        args.purchased_how_long_ago,
-        args.source_audio_book_directory,
-        args.libation_file_locations_path,
-    )
-
-    # Now that the files have been moved, we want to kick off the AudioBookShelf scanner
-    scan_library_for_books(args.server_url, args.library_id, args.abs_api_token, log_file)
-
-    # We often need a back-off time in order to allow the scan to complete
-    time.sleep(15)
+            # If books_json_path is the default OpenAudible path, use source-audio-book-directory instead
+            if "OpenAudible" in args.books_json_path:
+                args.books_json_path = os.path.join(args.source_audio_book_directory, "libation.json")
+                log_file.write(
+                    f"{datetime.now()} - INFO - Using source audio book directory for libation.json: "
+                    f"{args.books_json_path}\n"
+                )
+                log_file.flush()
+
+            success = generate_libation_json(args.books_json_path, log_file)
+            if not success:
+                log_file.write(
+                    f"{datetime.now()} - ERROR - Failed to generate libation.json. "
+                    "Please generate it manually using: "
+                    f"libationcli export --path {args.books_json_path} --json\n"
+                )
+                print(
+                    f"ERROR: Failed to auto-generate libation.json. "
+                    f"Please run: libationcli export --path {args.books_json_path} --json"
+                )
+                exit(1)
+
+        # This will process any files in the OpenAudible directory that is 7 days or newer
+        # According to current date as compared to the purchase date
+        book_list = move_audio_book_files(
+            args.audio_file_extension,
+            args.books_json_path,
+            args.copy_instead_of_move,
+            args.destination_book_directory,
+            args.download_program,
+            args.libation_folder_cleanup,
+            log_file,
+            args.purchased_how_long_ago,
+            args.source_audio_book_directory,
+            args.libation_file_locations_path,
+            args.allow_hardlinks,
+            processed_cache_path=args.processed_cache_path,
+        )
 
-    # Sometimes the scanner does not identify the books correctly
-    # In my case I buy books from audible so I want to force the match with audible content
-    books_from_audiobookshelf = get_all_books(args.server_url, args.library_id, args.abs_api_token, log_file)
-    most_recent_books = get_audio_bookshelf_recent_books(
-        books_from_audiobookshelf,
-        log_file,
-        days_ago=args.purchased_how_long_ago,
-        book_list=book_list,
-    )
-    _ = process_audio_books(most_recent_books, args.server_url, args.abs_api_token, log_file)
-    log_file.close()
+        # Now that the files have been moved, we want to kick off the AudioBookShelf scanner
+        previous_scan = get_library_last_scan(args.server_url, args.library_id, args.abs_api_token)
+        scan_library_for_books(args.server_url, args.library_id, args.abs_api_token, log_file)
+
+        # Wait for the scan to complete; the server's lastScan changes once it is done
+        wait_for_library_scan(args.server_url, args.library_id, args.abs_api_token, previous_scan, log_file)
+
+        # Sometimes the scanner does not identify the books correctly
+        # In my case I buy books from audible so I want to force the match with audible content
+        books_from_audiobookshelf = get_all_books(args.server_url, args.library_id, args.abs_api_token, log_file)
+        most_recent_books = get_audio_bookshelf_recent_books(
+            books_from_audiobookshelf,
+            log_file,
+            days_ago=args.purchased_how_long_ago,
+            book_list=book_list,
+        )
+        _ = process_audio_books(most_recent_books, args.server_url, args.abs_api_token, log_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+
+def pytest_configure(config):
+    """Put pytest's temporary directories under $PYTEST_TMPFS when it is set.
+
+    Pointing PYTEST_TMPFS at a tmpfs mount such as /dev/shm keeps the fixture files
+    in memory. Only the temporary root moves, so pytest still keeps its numbered
+    pytest-of-<user>/pytest-N directories and prunes the old ones. An explicit
+    PYTEST_DEBUG_TEMPROOT or --basetemp still wins.
+    """
+    tmpfs_dir = os.getenv("PYTEST_TMPFS")
+    if tmpfs_dir and os.path.isdir(tmpfs_dir):
+        os.environ.setdefault("PYTEST_DEBUG_TEMPROOT", tmpfs_dir)
+
+
+@pytest.fixture(scope="session")
+def log_file(tmp_path_factory):
+    """One buffered log file shared by every test that does not inspect its log."""
+    log_file = open(tmp_path_factory.mktemp("log") / "test.log", "a", buffering=1 << 16)
+    yield log_file
+    log_file.close()
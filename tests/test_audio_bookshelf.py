@@ -1,10 +1,15 @@
-from datetime import datetime, timedelta, timezone
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
-from modules.audio_bookshelf import get_all_books, get_audio_bookshelf_recent_books
+from modules.audio_bookshelf import (_RETRY, get_all_books, get_audio_bookshelf_recent_books, process_audio_books,
+                                     scan_library_for_books, wait_for_library_scan)
 
 
 @pytest.fixture
@@ -22,83 +27,78 @@ def setup_test_environment(tmp_path):
     }
 
 
+def _make_response(status, json_payload=None, body=b""):
+    """Build a real requests.Response, so ok, content and raise_for_status behave as they do on the wire."""
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(json_payload).encode() if json_payload is not None else body
+    return response
+
+
+@pytest.fixture
+def http_mock_factory(mocker):
+    """Build a requests.Session mock whose given method returns one canned response."""
+
+    def make(method, status, json_payload=None):
+        mock_session = mocker.Mock(spec=requests.Session)
+        getattr(mock_session, method).return_value = _make_response(status, json_payload)
+        return mock_session
+
+    return make
+
+
 @pytest.mark.parametrize(
-    "server_url, library_id, abs_api_token, query_params, expected_status",
+    "server_url, library_id, abs_api_token, expected_status",
     [
-        ("http://abs.example.com", "123456789", "asdflkjanelw123", None, 200),
-        ("http://abs.example.com", "123456789", "asdflkjanelw123", {"force": 1}, 200),
-        ("http://abs.example.com", "invalid_library_id", "asdflkjanelw123", None, 404),
+        ("http://abs.example.com", "123456789", "asdflkjanelw123", 200),
+        ("http://abs.example.com", "invalid_library_id", "asdflkjanelw123", 404),
     ],
 )
-def test_scan_library_for_books(server_url, library_id, abs_api_token, query_params, expected_status, mocker):
-    mock_post = mocker.patch("requests.post")
+def test_scan_library_for_books(server_url, library_id, abs_api_token, expected_status, http_mock_factory):
+    mock_session = http_mock_factory("post", expected_status)
+
+    response = scan_library_for_books(server_url, library_id, abs_api_token, session=mock_session)
+
+    assert response.status_code == expected_status
+    mock_session.post.assert_called_once_with(
+        f"{server_url}/api/libraries/{library_id}/scan",
+        headers={"Authorization": f"Bearer {abs_api_token}"},
+    )
 
-    mock_response = mocker.MagicMock()
-    mock_response.status_code = expected_status
-    mock_post.return_value = mock_response
-    url = f"{server_url}/api/libraries/{library_id}/scan"
-    headers = {"Authorization": f"Bearer {abs_api_token}"}
 
-    try:
-        response = requests.post(url, headers=headers, params=query_params)
-        assert response.status_code == expected_status
-    except HTTPError:
-        assert response.status_code == expected_status
+LIBRARY_ID = "1cc175ca-88b9-4910-abe5-bf10b8aaa702"
+
+
+def _mk_book(id_, added_at, title, subtitle="null", author="", series=""):
+    """Build a library item in the shape the AudioBookShelf items endpoint returns."""
+    return {
+        "id": id_,
+        "libraryId": LIBRARY_ID,
+        "addedAt": added_at,
+        "media": {"metadata": {"title": title, "subtitle": subtitle, "authorName": author, "seriesName": series}},
+    }
 
 
 BOOK_DATA = [
-    {
-        "id": "1caa6769-dffd-4594-8be6-b39620f1452e",
-        "libraryId": "1cc175ca-88b9-4910-abe5-bf10b8aaa702",
-        "addedAt": 1741404484782,
-        "media": {
-            "metadata": {
-                "title": "Daemon",
-                "subtitle": "null",
-                "authorName": "Daniel Suarez",
-                "seriesName": "Daemon #1",
-            }
-        },
-    },
-    {
-        "id": "fb258245-9ecb-43da-9b20-75ceb3f0511d",
-        "libraryId": "1cc175ca-88b9-4910-abe5-bf10b8aaa702",
-        "addedAt": 1741442608503,
-        "media": {
-            "metadata": {
-                "title": "The Name of the Wind",
-                "subtitle": "Kingkiller Chronicle, Book 1",
-                "authorName": "Patrick Rothfuss",
-                "seriesName": "Kingkiller Chronicle #1",
-            }
-        },
-    },
-    {
-        "id": "ab2afda0-479b-4d0d-b145-1c0fa01d8c08",
-        "libraryId": "1cc175ca-88b9-4910-abe5-bf10b8aaa702",
-        "addedAt": 1741404483947,
-        "media": {
-            "metadata": {
-                "title": "Never Split the Difference",
-                "subtitle": "Negotiating as if Your Life Depended on It",
-                "authorName": "Chris Voss",
-                "seriesName": "",
-            }
-        },
-    },
-    {
-        "id": "aa9b4d5c-fe04-482d-9296-6b2bfd280f9d",
-        "libraryId": "1cc175ca-88b9-4910-abe5-bf10b8aaa702",
-        "addedAt": 1741404483037,
-        "media": {
-            "metadata": {
-                "title": "Permanent Record",
-                "subtitle": "null",
-                "authorName": "Edward Snowden",
-                "seriesName": "",
-            }
-        },
-    },
+    _mk_book(
+        "1caa6769-dffd-4594-8be6-b39620f1452e", 1741404484782, "Daemon", author="Daniel Suarez", series="Daemon #1"
+    ),
+    _mk_book(
+        "fb258245-9ecb-43da-9b20-75ceb3f0511d",
+        1741442608503,
+        "The Name of the Wind",
+        subtitle="Kingkiller Chronicle, Book 1",
+        author="Patrick Rothfuss",
+        series="Kingkiller Chronicle #1",
+    ),
+    _mk_book(
+        "ab2afda0-479b-4d0d-b145-1c0fa01d8c08",
+        1741404483947,
+        "Never Split the Difference",
+        subtitle="Negotiating as if Your Life Depended on It",
+        author="Chris Voss",
+    ),
+    _mk_book("aa9b4d5c-fe04-482d-9296-6b2bfd280f9d", 1741404483037, "Permanent Record", author="Edward Snowden"),
 ]
 
 
@@ -130,41 +130,54 @@ def test_get_all_books(
     query_params,
     expected_status,
     results,
-    mocker,
+    http_mock_factory,
 ):
-    mock_get = mocker.patch("requests.get")
-
-    mock_response = mocker.MagicMock()
-    mock_response.status_code = expected_status
-    mock_get.return_value = mock_response
     expected_url = f"{server_url}/api/libraries/{library_id}/items?sort=addedAt"
-    expected_headers = {"Authorization": f"Bearer {abs_api_token}"}
+    expected_headers = {"Authorization": f"Bearer {abs_api_token}", "Accept-Encoding": "gzip, deflate"}
 
     if expected_status == 200:
-        mock_response.json.return_value = {
-            "results": results,
-            "total": len(results),
-            "limit": 0,
-            "page": 0,
-            "sortBy": "addedAt",
-            "sortDesc": False,
-            "mediaType": "book",
-            "minified": False,
-            "collapseseries": False,
-        }
+        mock_session = http_mock_factory(
+            "get",
+            expected_status,
+            json_payload={
+                "results": results,
+                "total": len(results),
+                "limit": 0,
+                "page": 0,
+                "sortBy": "addedAt",
+                "sortDesc": False,
+                "mediaType": "book",
+                "minified": False,
+                "collapseseries": False,
+            },
+        )
+        assert get_all_books(server_url, library_id, abs_api_token, session=mock_session) == results
     else:
-        # For error responses, raise an HTTPError when json() is called
-        mock_response.json.side_effect = HTTPError("Not found")
+        # For error responses, get_all_books raises instead of returning an empty library
+        mock_session = http_mock_factory("get", expected_status)
+        with pytest.raises(HTTPError):
+            get_all_books(server_url, library_id, abs_api_token, session=mock_session)
 
-    all_book_response = get_all_books(server_url, library_id, abs_api_token)
-    assert all_book_response.status_code == expected_status
+    mock_session.get.assert_called_once_with(expected_url, headers=expected_headers)
 
-    mock_get.assert_called_once_with(expected_url, headers=expected_headers)
 
-    if expected_status == 200:
-        response_data = all_book_response.json()
-        assert "results" in response_data
-        assert response_data["results"] == results
+# The clock is frozen at midday for the recent-books tests, so "N days ago" never straddles a day
+# boundary and every addedAt below is a fixed value rather than a fresh clock reading
+FROZEN_NOW = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+NOW_MS = int(FROZEN_NOW.timestamp() * 1000)
+DAY_MS = 86_400_000
+
+
+class _FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return FROZEN_NOW.astimezone(tz) if tz else FROZEN_NOW.replace(tzinfo=None)
+
+
+@pytest.fixture
+def frozen_now(monkeypatch):
+    monkeypatch.setattr("modules.audio_bookshelf.datetime", _FrozenDatetime)
+    return FROZEN_NOW
 
 
 TEST_DATA = [
@@ -172,21 +185,20 @@ TEST_DATA = [
         {
             "results": [
                 {
-                    "addedAt": int((datetime.now(timezone.utc) - timedelta(days=1)).timestamp() * 1000),
+                    "addedAt": NOW_MS - DAY_MS,
                     "media": {"metadata": {"title": "Book 1"}},
                 },
                 {
-                    "addedAt": int((datetime.now(timezone.utc) - timedelta(days=2)).timestamp() * 1000),
+                    "addedAt": NOW_MS - 2 * DAY_MS,
                     "media": {"metadata": {"title": "Book 2"}},
                 },
             ]
         },
-        None,
         1,
         [],
         [
             {
-                "addedAt": int((datetime.now(timezone.utc) - timedelta(days=1)).timestamp() * 1000),
+                "addedAt": NOW_MS - DAY_MS,
                 "media": {"metadata": {"title": "Book 1"}},
             }
         ],
@@ -195,39 +207,160 @@ TEST_DATA = [
         {
             "results": [
                 {
-                    "addedAt": int(datetime.now(timezone.utc).timestamp() * 1000),
+                    "addedAt": NOW_MS,
                     "media": {"metadata": {"title": "Book 1"}},
                 },
                 {
-                    "addedAt": int((datetime.now(timezone.utc) - timedelta(days=2)).timestamp() * 1000),
+                    "addedAt": NOW_MS - 2 * DAY_MS,
                     "media": {"metadata": {"title": "Book 2"}},
                 },
             ]
         },
-        None,
         0,
         [{"title": "Book 2", "asin": "asin2"}],
         [
             {
-                "addedAt": int((datetime.now(timezone.utc) - timedelta(days=2)).timestamp() * 1000),
+                "addedAt": NOW_MS - 2 * DAY_MS,
                 "media": {"metadata": {"title": "Book 2", "asin": "asin2"}},
             }
         ],
     ),
-    ({"results": []}, None, 1, [], []),
-    ({"results": []}, None, 0, [{"title": "Book 1", "asin": "asin1"}], []),
+    ({"results": []}, 1, [], []),
+    ({"results": []}, 0, [{"title": "Book 1", "asin": "asin1"}], []),
+    # Every item whose title contains the requested title is matched, including repeated titles,
+    # in the order the library returned them
+    (
+        {
+            "results": [
+                {"id": "a", "media": {"metadata": {"title": "Book 1"}}},
+                {"id": "b", "media": {"metadata": {"title": "Book 10"}}},
+                {"id": "c", "media": {"metadata": {"title": "Book 1"}}},
+                {"id": "d", "media": {"metadata": {"title": "Book 2"}}},
+            ]
+        },
+        0,
+        [{"title": "Book 1", "asin": "asin1"}],
+        [
+            {"id": "a", "media": {"metadata": {"title": "Book 1", "asin": "asin1"}}},
+            {"id": "b", "media": {"metadata": {"title": "Book 10", "asin": "asin1"}}},
+            {"id": "c", "media": {"metadata": {"title": "Book 1", "asin": "asin1"}}},
+        ],
+    ),
 ]
 
 
-@pytest.mark.parametrize("json_data, log_file, days_ago, book_list, expected_recent_items", TEST_DATA)
-def test_get_audio_bookshelf_recent_books(
-    json_data, log_file, days_ago, book_list, expected_recent_items, tmp_path, mocker
-):
+@pytest.mark.parametrize("json_data, days_ago, book_list, expected_recent_items", TEST_DATA)
+def test_get_audio_bookshelf_recent_books(json_data, days_ago, book_list, expected_recent_items, log_file, frozen_now):
     """Test cases for get_audio_bookshelf_recent_books function."""
-    response = mocker.MagicMock()
-    response.json.return_value = json_data
-    log_file = tmp_path / "test.log"
-    log_file.touch()
-    recent_items = get_audio_bookshelf_recent_books(response, days_ago=days_ago, book_list=book_list)
+    recent_items = get_audio_bookshelf_recent_books(
+        json_data["results"], log_file, days_ago=days_ago, book_list=book_list
+    )
 
     assert recent_items == expected_recent_items
+
+
+def test_process_audio_books(log_file, mocker, monkeypatch):
+    """Every item is matched and the responses come back in the order the items were given."""
+    notifications = []
+    monkeypatch.setattr("modules.audio_bookshelf.subprocess.Popen", lambda args, **kwargs: notifications.append(args))
+    mock_session = mocker.Mock(spec=requests.Session)
+
+    def fake_post(url, **kwargs):
+        if kwargs["json"]["title"] == "Permanent Record":
+            return _make_response(500, body=b"Internal Server Error")
+        return _make_response(200, {"url": url})
+
+    mock_session.post.side_effect = fake_post
+    items = [dict(book, media={"metadata": dict(book["media"]["metadata"], asin="ASIN")}) for book in BOOK_DATA]
+
+    results = process_audio_books(items, "http://abs.example.com", "token", log_file, session=mock_session)
+
+    expected = [{"url": f"http://abs.example.com/api/items/{item['id']}/match"} for item in items[:3]]
+    assert results == expected + [{"status_code": 500, "error": "Internal Server Error"}]
+    assert mock_session.post.call_count == len(items)
+    assert notifications == [["notify-send", "Error", "Matched 3 books; 1 errors:\nPermanent Record"]]
+
+
+@pytest.mark.parametrize(
+    "previous_scan, last_scans, expected_result, expected_calls",
+    [
+        (100, [100, 100, 250], True, 3),
+        (100, [None, 250], True, 2),
+        (100, [100, 100, 100], False, 3),
+        # Without a value from before the scan, the first value read may be the old scan, so it is not trusted
+        (None, [100, 250], True, 2),
+        (None, [None, 100, 250], True, 3),
+        (None, [100, 100, 100], False, 3),
+    ],
+)
+def test_wait_for_library_scan(previous_scan, last_scans, expected_result, expected_calls, mocker, monkeypatch):
+    """The wait ends as soon as lastScan moves past the value read before the scan, or on timeout."""
+    sleeps = []
+    monkeypatch.setattr("modules.audio_bookshelf.time.sleep", sleeps.append)
+    # Each poll advances the clock by one second so a 3 second timeout allows three polls
+    monkeypatch.setattr("modules.audio_bookshelf.time.monotonic", iter(range(100)).__next__)
+    mock_session = mocker.Mock(spec=requests.Session)
+    mock_session.get.side_effect = [_make_response(200, {"lastScan": last_scan}) for last_scan in last_scans]
+
+    result = wait_for_library_scan(
+        "http://abs.example.com", "lib1", "token", previous_scan, timeout=3, poll_interval=1, session=mock_session
+    )
+
+    assert result is expected_result
+    assert mock_session.get.call_count == expected_calls
+    assert len(sleeps) == expected_calls - 1
+    mock_session.get.assert_called_with(
+        "http://abs.example.com/api/libraries/lib1", headers={"Authorization": "Bearer token"}
+    )
+
+
+class _UnavailableHandler(BaseHTTPRequestHandler):
+    """Answer every request with 503 and count how many arrived."""
+
+    def _unavailable(self):
+        self.server.request_count += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b"Service Unavailable"
+        self.send_response(503)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _unavailable
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def unavailable_server():
+    """A local server that always returns 503, and a session using the module's retry policy without backoff."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _UnavailableHandler)
+    server.request_count = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(max_retries=_RETRY.new(backoff_factor=0)))
+    yield f"http://127.0.0.1:{server.server_address[1]}", server, session
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_exhausted_retries_return_the_last_response(unavailable_server, log_file, monkeypatch):
+    """A 503 that outlasts the retries reaches the normal status handling instead of raising RetryError."""
+    server_url, server, session = unavailable_server
+    notifications = []
+    monkeypatch.setattr("modules.audio_bookshelf.subprocess.Popen", lambda args, **kwargs: notifications.append(args))
+
+    response = scan_library_for_books(server_url, LIBRARY_ID, "token", session=session)
+    assert response.status_code == 503
+    assert server.request_count == _RETRY.total + 1
+
+    with pytest.raises(HTTPError):
+        get_all_books(server_url, LIBRARY_ID, "token", session=session)
+
+    items = [dict(book, media={"metadata": dict(book["media"]["metadata"], asin="ASIN")}) for book in BOOK_DATA[:2]]
+    results = process_audio_books(items, server_url, "token", log_file, session=session)
+    assert results == [{"status_code": 503, "error": "Service Unavailable"}] * 2
+    assert notifications == [["notify-send", "Error", "Matched 0 books; 2 errors:\nDaemon\nThe Name of the Wind"]]
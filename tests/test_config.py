@@ -1,7 +1,6 @@
 import logging
 import sys
-import tempfile
-from collections.abc import Generator
+from collections.abc import Callable, Generator
 from pathlib import Path
 
 import pytest
@@ -9,6 +8,9 @@ import yaml
 
 from modules.config import Config
 
+# libyaml's C emitter when available; the pure-Python dumper is much slower per fixture
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 @pytest.fixture
 def config_dict(request: pytest.FixtureRequest) -> Generator[dict, None, None]:
@@ -50,12 +52,27 @@ def cli_args(config_dict: dict) -> Generator[list[str], None, None]:
     yield args
 
 
+@pytest.fixture(scope="session")
+def yaml_config_writer(tmp_path_factory: pytest.TempPathFactory) -> Callable[[dict], str]:
+    # The file contents depend only on the config dict, so each distinct dict is written once per session
+    yaml_dir = tmp_path_factory.mktemp("yaml_configs")
+    written: dict[frozenset, str] = {}
+
+    def write(config_dict: dict) -> str:
+        key = frozenset(config_dict.items())
+        if key not in written:
+            yamlfile = yaml_dir / f"config_{len(written)}.yaml"
+            with open(yamlfile, "w") as file:
+                yaml.dump(config_dict, file, Dumper=_YAML_DUMPER)
+            written[key] = str(yamlfile)
+        return written[key]
+
+    return write
+
+
 @pytest.fixture
-def yaml_config(tmp_path: Path, config_dict: dict) -> Generator[str, None, None]:
-    yamlfile = tmp_path / "config.yaml"
-    with open(yamlfile, "w") as file:
-        yaml.dump(config_dict, file)
-    yield str(yamlfile)
+def yaml_config(yaml_config_writer: Callable[[dict], str], config_dict: dict) -> Generator[str, None, None]:
+    yield yaml_config_writer(config_dict)
 
 
 def test_yaml_load(config_dict: dict, yaml_config: str) -> None:
@@ -139,7 +156,6 @@ def assert_config_correct(config_dict: dict, config_obj: Config) -> None:
             [],
         ),
         # Invalid configuration: Missing all required fields → SystemExit and multiple critical log messages.
-        # Note: Order changed - books_json_path is now validated last due to special Libation handling
         (
             {},
             True,
@@ -187,41 +203,42 @@ def test_validate_param(config_kwargs, expect_exit, expected_logs, caplog):
             Config(**config_kwargs)._validate()
 
     if expect_exit:
-        # For invalid configurations, verify all expected log records are present.
-        assert caplog.record_tuples == expected_logs
+        # For invalid configurations, verify all expected log records are present, in any order.
+        assert set(caplog.record_tuples) == set(expected_logs)
+        assert len(caplog.record_tuples) == len(expected_logs)
     else:
         # For valid configurations, ensure no critical logs were generated.
         assert caplog.record_tuples == []
 
 
-@pytest.mark.parametrize(
-    "cli_args,expected_attr",
-    [
-        (["--abs-api-token", "123"], {"abs_api_token": "123"}),
-        (["--purchased-how-long-ago", "3"], {"purchased_how_long_ago": 3}),
-        (["--audio-file-extension", ".mp3"], {"audio_file_extension": ".mp3"}),
-        (["--libation-folder-cleanup", "True"], {"libation_folder_cleanup": True}),
-    ],
-)
-def test_cli_argument_parsing(cli_args, expected_attr):
+# These cases are too small to be worth a parametrized test each
+CLI_PARSING_CASES = [
+    (["--abs-api-token", "123"], {"abs_api_token": "123"}),
+    (["--purchased-how-long-ago", "3"], {"purchased_how_long_ago": 3}),
+    (["--audio-file-extension", ".mp3"], {"audio_file_extension": ".mp3"}),
+    (["--libation-folder-cleanup", "True"], {"libation_folder_cleanup": True}),
+]
+
+YAML_EXCLUSIVITY_CASES = [
+    ["--yaml", "config.yaml", "--abs-api-token", "123"],
+    ["--yaml", "config.yaml", "--days=5"],
+]
+
+
+def test_cli_argument_parsing():
     """Test individual CLI arguments set attributes correctly"""
-    # Add exit_on_error=False as first argument to isolate CLI args
-    config = Config.from_args(False, *cli_args)
-    for key, value in expected_attr.items():
-        assert getattr(config, key) == value
+    for cli_args, expected_attr in CLI_PARSING_CASES:
+        # Add exit_on_error=False as first argument to isolate CLI args
+        config = Config.from_args(False, *cli_args)
+        for key, value in expected_attr.items():
+            assert getattr(config, key) == value, (cli_args, key)
 
 
-@pytest.mark.parametrize(
-    "args",
-    [
-        ["--yaml", "config.yaml", "--abs-api-token", "123"],
-        ["--yaml", "config.yaml", "--days=5"],
-    ],
-)
-def test_yaml_exclusivity(args):
+def test_yaml_exclusivity():
     """Test YAML mode prevents other arguments"""
-    with pytest.raises(SystemExit):
-        Config.from_args(False, *args)
+    for args in YAML_EXCLUSIVITY_CASES:
+        with pytest.raises(SystemExit):
+            Config.from_args(False, *args)
 
 
 @pytest.mark.parametrize(
@@ -242,12 +259,9 @@ def test_yaml_exclusivity(args):
         ),
     ],
 )
-def test_from_args(yaml_content, expected_attrs):
+def test_from_args(yaml_content, expected_attrs, yaml_config_writer):
     """Test YAML configuration properly overrides defaults"""
-    with tempfile.NamedTemporaryFile(mode="w") as yaml_file:
-        yaml.dump(yaml_content, yaml_file)
-        yaml_file.seek(0)
-        config = Config.from_args(False, "--yaml", yaml_file.name)
+    config = Config.from_args(False, "--yaml", yaml_config_writer(yaml_content))
 
     for attr, value in expected_attrs.items():
         assert getattr(config, attr) == value
@@ -289,8 +303,10 @@ def test_from_args(yaml_content, expected_attrs):
                 "download_program": "OpenAudible",
                 "audio_file_extension": ".m4b",
                 "copy_instead_of_move": False,
+                "allow_hardlinks": False,
                 "libation_folder_cleanup": False,
                 "libation_file_locations_path": "",
+                "processed_cache_path": "",
                 "library_id": "123456",
                 "log_file_path": "/tmp/book_processing.txt",
                 "server_url": "http://example.com",
@@ -302,6 +318,9 @@ def test_from_args(yaml_content, expected_attrs):
 def test_generate_yaml_from_parser(arguments, expected_yaml, tmp_path: Path) -> None:
     config_obj = Config.from_args(False, *arguments)
     tmp_file = tmp_path / "config.yaml"
+    # The data can be checked in memory without writing the file
+    assert config_obj._yaml_export_data() == expected_yaml
+
     config_obj.generate_yaml_from_parser(tmp_file)
 
     with open(tmp_file, "r") as generated_file:
@@ -1,28 +1,51 @@
-import json
 import os
 from datetime import datetime, timezone
 from pathlib import Path
 
 import pytest
 
+from modules.utils import json_dumps
 from openaudible_to_ab import move_audio_book_files
 
+# Libation records DateAdded as a full timestamp; every case is added "now"
+_NOW_ISO = datetime.now(timezone.utc).isoformat()
 
-@pytest.fixture
-def setup_test_environment(tmp_path):
-    # Create temporary directories
+
+@pytest.fixture(scope="module")
+def setup_test_environment(tmp_path_factory):
+    # One directory tree is shared by every case in this module; each case uses its own
+    # AudibleProductId, so the source folders and destination paths never collide
+    tmp_path = tmp_path_factory.mktemp("libation")
     source_dir = tmp_path / "source"
     dest_dir = tmp_path / "dest"
     source_dir.mkdir()
     dest_dir.mkdir()
 
     return {
-        "source_dir": str(source_dir),
-        "dest_dir": str(dest_dir),
-        "tmp_path": str(tmp_path),
+        "source_dir": source_dir,
+        "dest_dir": dest_dir,
+        "tmp_path": tmp_path,
     }
 
 
+def _create_libation_book(source_dir: Path, book: dict) -> Path:
+    """Lay out a downloaded book the way Libation does and return the audio file path."""
+    # Libation creates folder names using only the part before the first colon
+    title_for_folder = book["Title"].split(":")[0].strip()
+    book_folder = source_dir / f"{title_for_folder} [{book['AudibleProductId']}]"
+    book_folder.mkdir(parents=True)
+
+    # Files keep the full title and subtitle
+    subtitle = book.get("Subtitle", "")
+    if subtitle:
+        file_name = f"{book['Title']}: {subtitle} [{book['AudibleProductId']}].m4b"
+    else:
+        file_name = f"{book['Title']} [{book['AudibleProductId']}].m4b"
+    source_file = book_folder / file_name
+    source_file.touch()
+    return source_file
+
+
 @pytest.mark.parametrize(
     "test_books, expected_path_suffix",
     [
@@ -34,7 +57,7 @@ def setup_test_environment(tmp_path):
                     "Title": "Libation Test",
                     "Subtitle": "A Demo",
                     "SeriesOrder": "1",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "Libation_Author/Libation_Test__A_Demo/Libation Test: A Demo [LIB456].m4b",
@@ -45,7 +68,7 @@ def setup_test_environment(tmp_path):
                     "AudibleProductId": "LIB789",
                     "AuthorNames": "Another Author",
                     "Title": "Another Book",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "Another_Author/Another_Book/Another Book [LIB789].m4b",
@@ -58,56 +81,39 @@ def setup_test_environment(tmp_path):
                     "AudibleProductId": "DISNEY123",
                     "AuthorNames": "Disney Author",
                     "Title": "Disney Agent Stitch: The M-Files",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "Disney_Author/Disney_Agent_Stitch_The_MFiles/Disney Agent Stitch: The M-Files [DISNEY123].m4b",
         ),
     ],
 )
-def test_libation_processing(setup_test_environment, test_books, expected_path_suffix):
-    source_dir = Path(setup_test_environment["source_dir"])
+def test_libation_processing(setup_test_environment, log_file, test_books, expected_path_suffix):
+    source_dir = setup_test_environment["source_dir"]
     # Dynamically create subfolders and files based on test data
     for book in test_books:
-        # Libation creates folder names using only the part before the first colon
-        title_for_folder = book["Title"].split(":")[0].strip()
-        book_folder_name = f"{title_for_folder} [{book['AudibleProductId']}]"
-        source_dir_with_subfolder = source_dir / book_folder_name
-        os.makedirs(source_dir_with_subfolder)
-
-        subtitle = book.get("Subtitle", "")
-        print(subtitle)
-        if subtitle:
-            file_name = f"{book['Title']}: {subtitle} [{book['AudibleProductId']}].m4b"
-        else:
-            file_name = f"{book['Title']} [{book['AudibleProductId']}].m4b"
-        print(file_name)
-        source_file = source_dir_with_subfolder / file_name
-        source_file.touch()
-    assert source_file.exists(), f"Source file {source_file} was not created."
+        _create_libation_book(source_dir, book)
 
     args = {
         "audio_file_extension": ".m4b",
-        "books_json_path": Path(setup_test_environment["tmp_path"]) / "books.json",
+        "books_json_path": setup_test_environment["tmp_path"] / "books.json",
         "copy_instead_of_move": False,
-        "destination_dir": setup_test_environment["dest_dir"],
+        "destination_dir": os.fspath(setup_test_environment["dest_dir"]),
         "download_program": "Libation",
         "libation_folder_cleanup": True,
-        "log_file": open(Path(setup_test_environment["tmp_path"]) / "test.log", "a"),
+        "log_file": log_file,
         "purchased_how_long_ago": 7,
-        "source_dir": str(source_dir),
+        "source_dir": os.fspath(source_dir),
         "libation_file_locations_path": "",
     }
 
-    with open(args["books_json_path"], "w") as f:  # Use 'w' to overwrite for each test case
-        json.dump(test_books, f)
+    # write_bytes overwrites the file for each test case
+    args["books_json_path"].write_bytes(json_dumps(test_books))
 
     result = move_audio_book_files(**args)
-    print(result)
-    args["log_file"].close()
 
-    expected_path = Path(args["destination_dir"]) / expected_path_suffix
-    assert expected_path.exists()
+    expected_path = os.path.join(args["destination_dir"], expected_path_suffix)
+    assert os.path.exists(expected_path)
     assert test_books[0]["Title"] in result[0]["title"]
 
 
@@ -121,7 +127,7 @@ def test_libation_processing(setup_test_environment, test_books, expected_path_s
                     "AuthorNames": "James Osiris Baldwin",
                     "Title": "The Archemi Online Chronicles Boxset",
                     "Subtitle": "Books 1, 2 & 3: A LitRPG Epic Fantasy Series (The Archemi Online Chronicles)",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "James_Osiris_Baldwin/"
@@ -137,7 +143,7 @@ def test_libation_processing(setup_test_environment, test_books, expected_path_s
                     "AuthorNames": "Disney Author",
                     "Title": "Disney Agent Stitch: The M-Files",
                     "Subtitle": "Rise of the Mansquito",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "Disney_Author/Disney_Agent_Stitch_The_MFiles__Rise_of_the_Mansquito/"
@@ -149,35 +155,22 @@ def test_libation_processing(setup_test_environment, test_books, expected_path_s
                     "AudibleProductId": "B0DQHNJ9WK",
                     "AuthorNames": "Minecraft Author",
                     "Title": "My Middle Name Is Minecraft",
-                    "DateAdded": datetime.now(timezone.utc).isoformat(),
+                    "DateAdded": _NOW_ISO,
                 }
             ],
             "Minecraft_Author/My_Middle_Name_Is_Minecraft/My Middle Name Is Minecraft [B0DQHNJ9WK].m4b",
         ),
     ],
 )
-def test_libation_with_file_locations_json(setup_test_environment, test_books, expected_path_suffix):
+def test_libation_with_file_locations_json(setup_test_environment, log_file, test_books, expected_path_suffix):
     """Test Libation processing with FileLocationsV2.json"""
-    source_dir = Path(setup_test_environment["source_dir"])
+    source_dir = setup_test_environment["source_dir"]
 
     # Create the file structure and FileLocationsV2.json for each book
     file_locations = {"Dictionary": {}}
 
     for book in test_books:
-        # Create the folder structure
-        title_for_folder = book["Title"].split(":")[0].strip()
-        book_folder = source_dir / f"{title_for_folder} [{book['AudibleProductId']}]"
-        book_folder.mkdir(parents=True)
-
-        # Create the file name
-        subtitle = book.get("Subtitle", "")
-        if subtitle:
-            file_name = f"{book['Title']}: {subtitle} [{book['AudibleProductId']}].m4b"
-        else:
-            file_name = f"{book['Title']} [{book['AudibleProductId']}].m4b"
-
-        source_file = book_folder / file_name
-        source_file.touch()
+        source_file = _create_libation_book(source_dir, book)
 
         # Add to FileLocationsV2.json structure
         file_locations["Dictionary"][book["AudibleProductId"]] = [
@@ -190,30 +183,104 @@ def test_libation_with_file_locations_json(setup_test_environment, test_books, e
         ]
 
     # Write FileLocationsV2.json
-    file_locations_path = Path(setup_test_environment["tmp_path"]) / "FileLocationsV2.json"
-    with open(file_locations_path, "w") as f:
-        json.dump(file_locations, f)
+    file_locations_path = setup_test_environment["tmp_path"] / "FileLocationsV2.json"
+    file_locations_path.write_bytes(json_dumps(file_locations))
 
     args = {
         "audio_file_extension": ".m4b",
-        "books_json_path": Path(setup_test_environment["tmp_path"]) / "books.json",
+        "books_json_path": setup_test_environment["tmp_path"] / "books.json",
         "copy_instead_of_move": False,
-        "destination_dir": setup_test_environment["dest_dir"],
+        "destination_dir": os.fspath(setup_test_environment["dest_dir"]),
         "download_program": "Libation",
         "libation_folder_cleanup": True,
-        "log_file": open(Path(setup_test_environment["tmp_path"]) / "test.log", "a"),
+        "log_file": log_file,
         "purchased_how_long_ago": 7,
-        "source_dir": str(source_dir),
+        "source_dir": os.fspath(source_dir),
         "libation_file_locations_path": str(file_locations_path),
     }
 
-    with open(args["books_json_path"], "w") as f:
-        json.dump(test_books, f)
+    args["books_json_path"].write_bytes(json_dumps(test_books))
 
     result = move_audio_book_files(**args)
-    args["log_file"].close()
 
     # Verify the file was moved to the correct destination
-    expected_path = Path(args["destination_dir"]) / expected_path_suffix
-    assert expected_path.exists(), f"Expected file at {expected_path} but it doesn't exist"
+    expected_path = os.path.join(args["destination_dir"], expected_path_suffix)
+    assert os.path.exists(expected_path), f"Expected file at {expected_path} but it doesn't exist"
     assert test_books[0]["Title"] in result[0]["title"]
+
+
+def test_libation_file_locations_keep_file_name(setup_test_environment, log_file):
+    """A file found through FileLocationsV2.json keeps its own name, even when it differs from the built one."""
+    book = {
+        "AudibleProductId": "CUSTOM42",
+        "AuthorNames": "Template Author",
+        "Title": "Template Book",
+        "DateAdded": _NOW_ISO,
+    }
+    # A custom Libation naming template and a non-default file type
+    book_folder = setup_test_environment["source_dir"] / "Template Author - Template Book"
+    book_folder.mkdir()
+    source_file = book_folder / "Template Author - Template Book.mp3"
+    source_file.touch()
+    location = {"Id": book["AudibleProductId"], "FileType": 1, "Path": {"Path": str(source_file)}}
+    file_locations = {"Dictionary": {book["AudibleProductId"]: [location]}}
+    file_locations_path = setup_test_environment["tmp_path"] / "FileLocationsV2_custom.json"
+    file_locations_path.write_bytes(json_dumps(file_locations))
+    books_json_path = setup_test_environment["tmp_path"] / "books_custom.json"
+    books_json_path.write_bytes(json_dumps([book]))
+
+    result = move_audio_book_files(
+        audio_file_extension=".m4b",
+        books_json_path=books_json_path,
+        copy_instead_of_move=False,
+        destination_dir=os.fspath(setup_test_environment["dest_dir"]),
+        download_program="Libation",
+        libation_folder_cleanup=False,
+        log_file=log_file,
+        purchased_how_long_ago=7,
+        source_dir=os.fspath(setup_test_environment["source_dir"]),
+        libation_file_locations_path=str(file_locations_path),
+    )
+
+    book_dir = os.path.join(setup_test_environment["dest_dir"], "Template_Author", "Template_Book")
+    assert os.listdir(book_dir) == ["Template Author - Template Book.mp3"]
+    assert result[0]["title"] == "Template Book"
+
+
+def test_libation_cleanup_failure_keeps_book(setup_test_environment, monkeypatch, tmp_path):
+    """A Libation folder that cannot be removed is logged, and the moved book is still returned."""
+    book = {
+        "AudibleProductId": "CLEAN77",
+        "AuthorNames": "Cleanup Author",
+        "Title": "Cleanup Book",
+        "DateAdded": _NOW_ISO,
+    }
+    source_file = _create_libation_book(setup_test_environment["source_dir"], book)
+    books_json_path = setup_test_environment["tmp_path"] / "books_cleanup.json"
+    books_json_path.write_bytes(json_dumps([book]))
+
+    def failing_rmtree(path, *args, **kwargs):
+        raise PermissionError(13, "Permission denied", os.fspath(path))
+
+    monkeypatch.setattr("openaudible_to_ab.shutil.rmtree", failing_rmtree)
+    log_path = tmp_path / "cleanup.log"
+    with open(log_path, "w") as cleanup_log:
+        result = move_audio_book_files(
+            audio_file_extension=".m4b",
+            books_json_path=books_json_path,
+            copy_instead_of_move=False,
+            destination_dir=os.fspath(setup_test_environment["dest_dir"]),
+            download_program="Libation",
+            libation_folder_cleanup=True,
+            log_file=cleanup_log,
+            purchased_how_long_ago=7,
+            source_dir=os.fspath(setup_test_environment["source_dir"]),
+        )
+
+    assert [book_data["title"] for book_data in result] == ["Cleanup Book"]
+    assert os.path.exists(
+        os.path.join(setup_test_environment["dest_dir"], "Cleanup_Author", "Cleanup_Book", source_file.name)
+    )
+    log_text = log_path.read_text()
+    assert f"WARNING - Could not remove the Libation folder {source_file.parent}" in log_text
+    assert "ERROR" not in log_text
@@ -1,105 +1,146 @@
+import io
 import json
 import os
+import shutil
+import tempfile
 from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 import pytest
 
-from modules.utils import sanitize_name
+from modules.utils import json_dumps, sanitize_name
 from openaudible_to_ab import make_directory_structure, move_audio_book_files, process_open_audible_book_json
 
+# Purchase dates are computed once per module: today, inside the 7 day window, and outside it
+_TODAY = datetime.now(timezone.utc).date()
+_NOW_ISO = _TODAY.isoformat()
+_RECENT_ISO = (_TODAY - timedelta(days=5)).isoformat()
+_OLD_ISO = (_TODAY - timedelta(days=10)).isoformat()
+
+# Books used by the tests below, keyed by the book's filename
+_BOOKS = {
+    "old_book": {
+        "author": "Old Author",
+        "title": "Old Book",
+        "asin": "OLD789",
+        "filename": "old_book",
+        "purchase_date": _OLD_ISO,
+    },
+    "new_book": {
+        "author": "New Author",
+        "title": "New Book",
+        "asin": "NEW456",
+        "filename": "new_book",
+        "purchase_date": _RECENT_ISO,
+    },
+    "conflict_book": {
+        "author": "Conflict Author",
+        "title": "Conflict Book",
+        "asin": "CONF123",
+        "filename": "conflict_book",
+        "purchase_date": _NOW_ISO,
+    },
+}
+
+# books.json payloads shared by the tests below
+_BOOKS_JSON_CORPUS = {
+    "date_window": [_BOOKS["old_book"], _BOOKS["new_book"]],
+    "conflict_book": [_BOOKS["conflict_book"]],
+}
+
+
+def _sparse(path: str, size: int) -> None:
+    """Create a fake audio file that reports the given size without writing any data."""
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+@pytest.fixture(scope="session")
+def books_corpus(tmp_path_factory):
+    """Write each books.json payload once per session.
+
+    The code under test only reads these files, so every test can share them.
+
+    Returns:
+        dict: Payload name to the path of its books.json.
+    """
+    corpus_dir = tmp_path_factory.mktemp("corpus")
+    corpus = {}
+    for name, books in _BOOKS_JSON_CORPUS.items():
+        books_json_path = corpus_dir / f"{name}.json"
+        books_json_path.write_bytes(json_dumps(books))
+        corpus[name] = str(books_json_path)
+    return corpus
+
+
+@pytest.fixture(scope="session")
+def suite_root(tmp_path_factory):
+    """One root for every test's directories, removed in a single pass at the end of the session."""
+    root = tmp_path_factory.mktemp("oa_suite", numbered=False)
+    yield root
+    shutil.rmtree(root, ignore_errors=True)
+
 
 @pytest.fixture
-def setup_test_environment(tmp_path):
-    # Create temporary directories
-    source_dir = tmp_path / "source"
-    dest_dir = tmp_path / "dest"
-    source_dir.mkdir()
-    dest_dir.mkdir()
+def setup_test_environment(suite_root):
+    # Each test gets its own directory under the shared root
+    test_dir = tempfile.mkdtemp(dir=suite_root)
+    # Only the source dir is created up front; dest is created on demand along with the book dirs
+    source_dir = os.path.join(test_dir, "source")
+    dest_dir = os.path.join(test_dir, "dest")
+    os.mkdir(source_dir)
 
     return {
-        "source_dir": str(source_dir),
-        "dest_dir": str(dest_dir),
-        "tmp_path": str(tmp_path),
+        "source_dir": source_dir,
+        "dest_dir": dest_dir,
+        "tmp_path": test_dir,
     }
 
 
-@pytest.mark.parametrize(
-    "test_data",
-    [
-        (
-            {
-                "author": "Old Author",
-                "title": "Old Book",
-                "asin": "OLD789",
-                "filename": "old_book",
-                "purchase_date": (datetime.now(timezone.utc) - timedelta(days=10)).date().isoformat(),
-            }
-        ),
-        (
-            {
-                "author": "New Author",
-                "title": "New Book",
-                "asin": "NEW456",
-                "filename": "new_book",
-                "purchase_date": (datetime.now(timezone.utc) - timedelta(days=5)).date().isoformat(),
-            }
-        ),
-    ],
-)
-def test_date_filtering(setup_test_environment, test_data):
-
+def test_date_filtering(setup_test_environment, books_corpus, log_file, mocker):
+    # Only the return value matters here, so the transfer is stubbed out
+    transfer = mocker.patch("openaudible_to_ab.move_file")
+    # Both books are downloaded, but only the new one was purchased in the last 7 days
+    for book in _BOOKS_JSON_CORPUS["date_window"]:
+        _sparse(os.path.join(setup_test_environment["source_dir"], f"{book['filename']}.m4b"), 0)
     args = {
         "audio_file_extension": ".m4b",
-        "books_json_path": os.path.join(setup_test_environment["tmp_path"], "books.json"),
+        "books_json_path": books_corpus["date_window"],
         "copy_instead_of_move": False,
         "destination_dir": setup_test_environment["dest_dir"],
         "download_program": "OpenAudible",
         "libation_folder_cleanup": False,
-        "log_file": open(os.path.join(setup_test_environment["tmp_path"], "test.log"), "a"),
+        "log_file": log_file,
         "purchased_how_long_ago": 7,
         "source_dir": setup_test_environment["source_dir"],
     }
 
-    with open(args["books_json_path"], "w") as f:
-        json.dump([test_data], f)
-
     result = move_audio_book_files(**args)
-    assert len(result) == 0
+    assert len(result) == 1 and result[0]["title"] == "New Book"
+    transfer.assert_called_once()
 
 
-@pytest.mark.parametrize(
-    "test_data",
-    [
-        {
-            "author": "Conflict Author",
-            "title": "Conflict Book",
-            "asin": "CONF123",
-            "filename": "conflict_book",
-            "purchase_date": datetime.now(timezone.utc).date().isoformat(),
-        }
-    ],
-)
-def test_existing_file_handling(setup_test_environment, test_data):
+def test_existing_file_handling(setup_test_environment, books_corpus, log_file, mocker):
     # Create test data with different file sizes
+    test_data = _BOOKS["conflict_book"]
     args = {
         "audio_file_extension": ".m4b",
-        "books_json_path": os.path.join(setup_test_environment["tmp_path"], "books.json"),
+        "books_json_path": books_corpus["conflict_book"],
         "copy_instead_of_move": False,
         "destination_dir": setup_test_environment["dest_dir"],
         "download_program": "OpenAudible",
         "libation_folder_cleanup": False,
-        "log_file": open(os.path.join(setup_test_environment["tmp_path"], "test.log"), "a"),
+        "log_file": log_file,
         "purchased_how_long_ago": 7,
         "source_dir": setup_test_environment["source_dir"],
     }
 
-    with open(args["books_json_path"], "w") as f:
-        json.dump([test_data], f)
-
     # Create source file
     source_path = os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b")
-    with open(source_path, "wb") as f:
-        f.write(b"smaller file")  # 12 bytes
+    _sparse(source_path, 12)
 
     # Create existing destination file
     dest_path = os.path.join(
@@ -108,48 +149,88 @@ def test_existing_file_handling(setup_test_environment, test_data):
         test_data["title"].replace(" ", "_"),
         f"{test_data['filename']}.m4b",
     )
-    os.makedirs(os.path.dirname(dest_path))
-    with open(dest_path, "wb") as f:
-        f.write(b"larger existing file content")  # 28 bytes
+    Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
+    _sparse(dest_path, 28)
 
+    transfer = mocker.patch("openaudible_to_ab.move_file")
     result = move_audio_book_files(**args)
-    assert os.path.getsize(dest_path) == 28  # Should not replace
+    transfer.assert_not_called()  # Should not replace
     assert len(result) == 0
 
 
+def test_existing_file_replaced_by_larger_download(setup_test_environment, books_corpus, log_file, mocker):
+    test_data = _BOOKS["conflict_book"]
+    args = {
+        "audio_file_extension": ".m4b",
+        "books_json_path": books_corpus["conflict_book"],
+        "copy_instead_of_move": False,
+        "destination_dir": setup_test_environment["dest_dir"],
+        "download_program": "OpenAudible",
+        "libation_folder_cleanup": False,
+        "log_file": log_file,
+        "purchased_how_long_ago": 7,
+        "source_dir": setup_test_environment["source_dir"],
+    }
+
+    source_path = os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b")
+    _sparse(source_path, 30)
+
+    dest_path = os.path.join(
+        setup_test_environment["dest_dir"],
+        test_data["author"].replace(" ", "_"),
+        test_data["title"].replace(" ", "_"),
+        f"{test_data['filename']}.m4b",
+    )
+    Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
+    _sparse(dest_path, 12)
+
+    # source and dest share one test directory, so the move is a rename and never falls back to copying
+    copy_fallback = mocker.patch("modules.utils.shutil.move")
+    result = move_audio_book_files(**args)
+    copy_fallback.assert_not_called()
+    assert os.path.getsize(dest_path) == 30  # Should replace
+    assert not os.path.exists(source_path)
+    assert len(result) == 1
+
+
 @pytest.mark.parametrize(
-    "invalid_input",
+    "file_name,contents",
     [
-        ("invalid_json.json",),
-        ("missing_file.json",),
+        ("invalid_json.json", b"{not json"),
+        ("missing_file.json", None),
     ],
 )
-def test_error_handling(setup_test_environment, invalid_input):
-    with pytest.raises(SystemExit):
+def test_error_handling(setup_test_environment, file_name, contents):
+    books_json_path = os.path.join(setup_test_environment["tmp_path"], file_name)
+    if contents is not None:
+        Path(books_json_path).write_bytes(contents)
+    # The error is only logged, so an in-memory log is enough to check it
+    log_file = io.StringIO()
+    with pytest.raises((IOError, json.JSONDecodeError)):
         move_audio_book_files(
             audio_file_extension=".m4b",
-            books_json_path=invalid_input[0],
+            books_json_path=books_json_path,
             copy_instead_of_move=False,
             destination_dir=setup_test_environment["dest_dir"],
             download_program="OpenAudible",
             libation_folder_cleanup=False,
-            log_file=open(os.path.join(setup_test_environment["tmp_path"], "test.log"), "a"),
+            log_file=log_file,
             purchased_how_long_ago=7,
             source_dir=setup_test_environment["source_dir"],
         )
+    assert "Error reading JSON file" in log_file.getvalue()
 
 
-@pytest.mark.parametrize(
-    "text,expected_transformed_text",
-    [
-        ("some text", "some_text"),
-        ("other.,text", "other.text"),
-        ("valid_text", "valid_text"),
-    ],
-)
-def test_sanitize_name(text, expected_transformed_text):
-    sanitzed_text = sanitize_name(text)
-    assert sanitzed_text == expected_transformed_text
+SANITIZE_CASES = {
+    "some text": "some_text",
+    "other.,text": "other.text",
+    "valid_text": "valid_text",
+}
+
+
+def test_sanitize_name():
+    for text, expected_transformed_text in SANITIZE_CASES.items():
+        assert sanitize_name(text) == expected_transformed_text, text
 
 
 @pytest.mark.parametrize(
@@ -202,3 +283,135 @@ def test_make_directory_structure(author: str, series: str, title: str, abs_fold
 def test_process_open_audible_book_json(book_data, expected_book_data):
     processed_book = process_open_audible_book_json(book_data.copy())
     assert processed_book == expected_book_data
+
+
+def test_processed_cache_skips_unchanged_downloads(setup_test_environment, log_file):
+    test_data = {
+        "author": "Cached Author",
+        "title": "Cached Book",
+        "asin": "CACHE123",
+        "filename": "cached_book",
+        "purchase_date": _NOW_ISO,
+    }
+    cache_path = os.path.join(setup_test_environment["tmp_path"], "cache", "processed.json")
+    books_json_path = os.path.join(setup_test_environment["tmp_path"], "books.json")
+    Path(books_json_path).write_bytes(json_dumps([test_data]))
+    source_path = os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b")
+    _sparse(source_path, 23)
+
+    def run():
+        return move_audio_book_files(
+            audio_file_extension=".m4b",
+            books_json_path=books_json_path,
+            copy_instead_of_move=True,
+            destination_dir=setup_test_environment["dest_dir"],
+            download_program="OpenAudible",
+            libation_folder_cleanup=False,
+            log_file=log_file,
+            purchased_how_long_ago=7,
+            source_dir=setup_test_environment["source_dir"],
+            processed_cache_path=cache_path,
+        )
+
+    assert len(run()) == 1
+    assert os.path.exists(cache_path)
+    # The copied book is unchanged, so the second run does not copy it again
+    assert run() == []
+
+    # A new download of the same book is picked up again
+    _sparse(source_path, 35)
+    assert len(run()) == 1
+
+    # A library copy that went missing is restored even though the download is unchanged
+    os.remove(os.path.join(setup_test_environment["dest_dir"], "Cached_Author", "Cached_Book", "cached_book.m4b"))
+    assert len(run()) == 1
+
+
+def test_processed_cache_drops_entries_for_missing_downloads(setup_test_environment, log_file):
+    cache_path = os.path.join(setup_test_environment["tmp_path"], "processed.json")
+    stale_entry = [os.path.join(setup_test_environment["source_dir"], "gone.m4b"), 1, 2, "/library"]
+    Path(cache_path).write_bytes(json_dumps([stale_entry]))
+    test_data = dict(_BOOKS["conflict_book"])
+    books_json_path = os.path.join(setup_test_environment["tmp_path"], "books.json")
+    Path(books_json_path).write_bytes(json_dumps([test_data]))
+    _sparse(os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b"), 12)
+
+    result = move_audio_book_files(
+        audio_file_extension=".m4b",
+        books_json_path=books_json_path,
+        copy_instead_of_move=False,
+        destination_dir=setup_test_environment["dest_dir"],
+        download_program="OpenAudible",
+        libation_folder_cleanup=False,
+        log_file=log_file,
+        purchased_how_long_ago=7,
+        source_dir=setup_test_environment["source_dir"],
+        processed_cache_path=cache_path,
+    )
+
+    assert len(result) == 1
+    # Neither the stale entry nor the book just moved away can match again, so neither is kept
+    assert json.loads(Path(cache_path).read_bytes()) == []
+
+
+@pytest.mark.parametrize(
+    "cache_arg, cache_location",
+    [
+        ("processed.json", ("work", "processed.json")),
+        ("~/.cache/openaudible_to_ab/processed.json", ("home", ".cache", "openaudible_to_ab", "processed.json")),
+    ],
+    ids=["bare_filename", "home_relative"],
+)
+def test_processed_cache_path_forms(
+    setup_test_environment, books_corpus, log_file, monkeypatch, cache_arg, cache_location
+):
+    tmp_dir = setup_test_environment["tmp_path"]
+    os.mkdir(os.path.join(tmp_dir, "work"))
+    monkeypatch.chdir(os.path.join(tmp_dir, "work"))
+    monkeypatch.setenv("HOME", os.path.join(tmp_dir, "home"))
+    test_data = _BOOKS["conflict_book"]
+    _sparse(os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b"), 12)
+
+    result = move_audio_book_files(
+        audio_file_extension=".m4b",
+        books_json_path=books_corpus["conflict_book"],
+        copy_instead_of_move=True,
+        destination_dir=setup_test_environment["dest_dir"],
+        download_program="OpenAudible",
+        libation_folder_cleanup=False,
+        log_file=log_file,
+        purchased_how_long_ago=7,
+        source_dir=setup_test_environment["source_dir"],
+        processed_cache_path=cache_arg,
+    )
+
+    assert len(result) == 1
+    assert os.path.isfile(os.path.join(tmp_dir, *cache_location))
+    # ~ is expanded rather than created as a literal directory
+    assert not os.path.exists(os.path.join(tmp_dir, "work", "~"))
+
+
+def test_processed_cache_write_failure_is_logged(setup_test_environment, books_corpus):
+    tmp_dir = setup_test_environment["tmp_path"]
+    # A regular file where the cache directory should be makes the cache write fail
+    Path(tmp_dir, "not_a_directory").touch()
+    test_data = _BOOKS["conflict_book"]
+    _sparse(os.path.join(setup_test_environment["source_dir"], f"{test_data['filename']}.m4b"), 12)
+    log_file = io.StringIO()
+
+    result = move_audio_book_files(
+        audio_file_extension=".m4b",
+        books_json_path=books_corpus["conflict_book"],
+        copy_instead_of_move=True,
+        destination_dir=setup_test_environment["dest_dir"],
+        download_program="OpenAudible",
+        libation_folder_cleanup=False,
+        log_file=log_file,
+        purchased_how_long_ago=7,
+        source_dir=setup_test_environment["source_dir"],
+        processed_cache_path=os.path.join(tmp_dir, "not_a_directory", "processed.json"),
+    )
+
+    # The book still counts as transferred, so it is still scanned and matched
+    assert len(result) == 1
+    assert "WARNING - Could not write the processed-books cache" in log_file.getvalue()
@@ -1,9 +1,9 @@
-import json
+import os
 from datetime import datetime, timezone
-from pathlib import Path
 
 import pytest
 
+from modules.utils import json_dumps
 from openaudible_to_ab import move_audio_book_files
 
 
@@ -16,57 +16,60 @@ def setup_test_environment(tmp_path):
     dest_dir.mkdir()
 
     return {
-        "source_dir": str(source_dir),
-        "dest_dir": str(dest_dir),
-        "tmp_path": str(tmp_path),
+        "source_dir": source_dir,
+        "dest_dir": dest_dir,
+        "tmp_path": tmp_path,
     }
 
 
-def test_open_audible_processing(setup_test_environment):
-    # Create test JSON data
-    test_books = [
-        {
-            "author": "Test Author, Jr.",
-            "title": "Sample Book",
-            "title_short": "Sample Book",
-            "asin": "TEST123",
-            "filename": "sample_book",
-            "purchase_date": datetime.now(timezone.utc).date().isoformat(),
-            "series_name": "Test Series",
-        }
-    ]
+_NOW_ISO = datetime.now(timezone.utc).date().isoformat()
+
+# The books.json fixture never changes, so it is encoded once at import
+_OPEN_AUDIBLE_BOOKS = [
+    {
+        "author": "Test Author, Jr.",
+        "title": "Sample Book",
+        "title_short": "Sample Book",
+        "asin": "TEST123",
+        "filename": "sample_book",
+        "purchase_date": _NOW_ISO,
+        "series_name": "Test Series",
+    }
+]
+_OPEN_AUDIBLE_FIXTURE = json_dumps(_OPEN_AUDIBLE_BOOKS)
+
+
+def test_open_audible_processing(setup_test_environment, log_file):
 
     # Create test files using Path
-    source_dir = Path(setup_test_environment["source_dir"])
+    source_dir = setup_test_environment["source_dir"]
     source_file = source_dir / "sample_book.m4b"
     source_file.touch()
 
     # Test parameters
     args = {
         "audio_file_extension": ".m4b",
-        "books_json_path": Path(setup_test_environment["tmp_path"]) / "books.json",
+        "books_json_path": setup_test_environment["tmp_path"] / "books.json",
         "copy_instead_of_move": False,
-        "destination_dir": setup_test_environment["dest_dir"],
+        "destination_dir": os.fspath(setup_test_environment["dest_dir"]),
         "download_program": "OpenAudible",
         "libation_folder_cleanup": False,
-        "log_file": open(Path(setup_test_environment["tmp_path"]) / "test.log", "a"),
+        "log_file": log_file,
         "purchased_how_long_ago": 7,
-        "source_dir": str(source_dir),  # Ensure string path for code compatibility
+        "source_dir": os.fspath(source_dir),
     }
 
     # Write test JSON file
-    with open(args["books_json_path"], "a") as f:
-        json.dump(test_books, f)
+    args["books_json_path"].write_bytes(_OPEN_AUDIBLE_FIXTURE)
 
     result = move_audio_book_files(**args)
-    args["log_file"].close()
     # Verify path construction
-    expected_path = (
-        Path(args["destination_dir"])
-        / "Test_Author"  # Sanitized from "Test Author, Jr."
-        / "Test_Series"
-        / "Sample_Book"
-        / "sample_book.m4b"
+    expected_path = os.path.join(
+        args["destination_dir"],
+        "Test_Author",  # Sanitized from "Test Author, Jr."
+        "Test_Series",
+        "Sample_Book",
+        "sample_book.m4b",
     )
-    assert expected_path.exists()
+    assert os.path.exists(expected_path)
     assert "Sample Book" in result[0]["title"]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from modules import search_ai
+from modules.search_ai import search_books, search_perplexity
+
+
+@pytest.fixture(autouse=True)
+def lookup_cache(tmp_path, monkeypatch):
+    """Keep the on-disk lookup cache inside the test's temporary directory."""
+    cache_path = tmp_path / "cache" / "lookups.sqlite3"
+    monkeypatch.setattr(search_ai, "_CACHE_PATH", cache_path)
+    return cache_path
+
+
+@pytest.mark.parametrize(
+    "book_titles, expected",
+    [
+        (
+            ["Daemon", "Permanent Record"],
+            {"Daemon": {"title": "DAEMON"}, "Permanent Record": {"title": "PERMANENT RECORD"}},
+        ),
+        (["Daemon", "Daemon"], {"Daemon": {"title": "DAEMON"}}),
+        ([], {}),
+    ],
+    ids=["multiple", "duplicates", "empty"],
+)
+def test_search_books(book_titles, expected, mocker):
+    search = mocker.Mock(side_effect=lambda title, api_key: {"title": title.upper()})
+
+    assert search_books(book_titles, "api_key", search=search) == expected
+    assert search.call_count == len(expected)
+
+
+def test_search_perplexity_cached(mocker):
+    answer = {
+        "author": "Daniel Suarez",
+        "book_title": "Daemon",
+        "book_sequence_number": 1,
+        "book_series_title": "Daemon",
+    }
+    mock_post = mocker.patch.object(search_ai._SESSION, "post")
+    mock_post.return_value.content = json.dumps({"choices": [{"message": {"content": json.dumps(answer)}}]}).encode()
+
+    assert search_perplexity("Daemon", "api_key") == answer
+    # Titles are normalized, so a differently formatted title is served from the cache
+    assert search_perplexity("  daemon ", "api_key") == answer
+    assert mock_post.call_count == 1
+
+
+def test_search_cache_expired(mocker, monkeypatch):
+    search = mocker.Mock(__name__="search", return_value={"title": "Daemon"})
+    cached_search = search_ai._cached_search("model")(search)
+
+    cached_search("Daemon", "api_key")
+    monkeypatch.setattr(search_ai, "_CACHE_TTL_SECONDS", -1)
+    cached_search("Daemon", "api_key")
+
+    assert search.call_count == 2
+
+
+def test_search_errors_not_cached(mocker):
+    search = mocker.Mock(__name__="search", return_value={"error": "Failed to parse JSON from API response"})
+    cached_search = search_ai._cached_search("model")(search)
+
+    cached_search("Daemon", "api_key")
+    cached_search("Daemon", "api_key")
+
+    assert search.call_count == 2
+
+
+def test_search_unwritable_cache(tmp_path, mocker, monkeypatch):
+    # A regular file where the cache directory should be makes every cache access fail with OSError
+    blocker = tmp_path / "not_a_directory"
+    blocker.touch()
+    monkeypatch.setattr(search_ai, "_CACHE_PATH", blocker / "cache" / "lookups.sqlite3")
+    search = mocker.Mock(__name__="search", return_value={"title": "Daemon"})
+    cached_search = search_ai._cached_search("model")(search)
+
+    # The lookup still runs, just uncached
+    assert cached_search("Daemon", "api_key") == {"title": "Daemon"}
+    assert cached_search("Daemon", "api_key") == {"title": "Daemon"}
+    assert search.call_count == 2
@@ -1,8 +1,11 @@
+import errno
 import os
+import subprocess
 
 import pytest
 
-from modules.utils import _parse_date, make_directory_structure, sanitize_name
+from modules.utils import (_parse_date, copy_file, generate_libation_json, make_directory_structure, move_file,
+                           sanitize_name)
 
 
 @pytest.mark.parametrize(
@@ -33,61 +36,127 @@ def test_valid_date_formats(date_str, expected):
     assert result == expected
 
 
-@pytest.mark.parametrize(
-    "author_dir, series_dir, book_title_dir, destination_dir",
-    [
-        ("Author1", "Series1", "Book1", "test_dir"),  # Basic test
-        ("Author2", None, "Book2", "test_dir"),  # Test with no series
-        ("Author3", "Series3", "Book3", ""),  # Test with empty destination
-    ],
-    ids=["basic", "no_series", "empty_destination"],
-)
-def test_make_directory_structure(author_dir, series_dir, book_title_dir, destination_dir, tmp_path):
+def test_invalid_date_format():
+    with pytest.raises(ValueError):
+        _parse_date("April 24, 2024")
 
-    # Arrange
-    temp_dest = tmp_path / destination_dir
 
-    # Act
-    result = make_directory_structure(author_dir, series_dir, book_title_dir, str(temp_dest))
+DIRECTORY_STRUCTURE_CASES = [
+    ("Author1", "Series1", "Book1", "test_dir"),  # Basic test
+    ("Author2", None, "Book2", "test_dir"),  # Test with no series
+    ("Author3", "Series3", "Book3", ""),  # Test with empty destination
+]
 
-    # Assert
-    expected_dir = temp_dest / author_dir
-    if series_dir:
-        expected_dir = expected_dir / series_dir
-    expected_dir = expected_dir / book_title_dir
-    assert result == str(expected_dir)
-    assert os.path.exists(expected_dir)
 
+def test_make_directory_structure(tmp_path):
+    # Every case uses its own author, so they can share one destination root
+    for author_dir, series_dir, book_title_dir, destination_dir in DIRECTORY_STRUCTURE_CASES:
+        # Arrange
+        temp_dest = tmp_path / destination_dir
 
-@pytest.mark.parametrize(
-    "name, expected",
-    [
-        ("Name, with commas", "Name_with_commas"),  # Commas replaced
-        ("Name with spaces", "Name_with_spaces"),  # Spaces replaced
-        ("Name.with.periods", "Name.with.periods"),  # Periods preserved
-        ("Name_with_underscores", "Name_with_underscores"),  # Underscores preserved
-        (
-            "Name invalid characters!",
-            "Name_invalid_characters",
-        ),  # Invalid characters removed
-        (
-            "Name with trailing spaces   ",
-            "Name_with_trailing_spaces___",
-        ),  # Trailing spaces removed
-        ("", ""),  # Empty string
-    ],
-    ids=[
-        "commas",
-        "spaces",
-        "periods",
-        "underscores",
-        "invalid_chars",
-        "trailing_spaces",
-        "empty_string",
-    ],
-)
+        # Act
+        result = make_directory_structure(author_dir, series_dir, book_title_dir, str(temp_dest))
+
+        # Assert
+        expected_dir = temp_dest / author_dir
+        if series_dir:
+            expected_dir = expected_dir / series_dir
+        expected_dir = expected_dir / book_title_dir
+        assert result == str(expected_dir), author_dir
+        assert os.path.isdir(expected_dir), author_dir
+
+    # Nothing else was created at the top of the destination
+    assert {entry.name for entry in os.scandir(tmp_path)} == {"test_dir", "Author3"}
+
+
+# Built once at import, with each case's id next to its data
+SANITIZE_NAME_CASES = [
+    pytest.param("Name, with commas", "Name_with_commas", id="commas"),  # Commas replaced
+    pytest.param("Name with spaces", "Name_with_spaces", id="spaces"),  # Spaces replaced
+    pytest.param("Name.with.periods", "Name.with.periods", id="periods"),  # Periods preserved
+    pytest.param("Name_with_underscores", "Name_with_underscores", id="underscores"),  # Underscores preserved
+    pytest.param("Name invalid characters!", "Name_invalid_characters", id="invalid_chars"),  # Invalid chars removed
+    pytest.param(
+        "Name with trailing spaces   ", "Name_with_trailing_spaces___", id="trailing_spaces"
+    ),  # Trailing spaces removed
+    pytest.param("", "", id="empty_string"),  # Empty string
+    pytest.param("Café Müller", "Café_Müller", id="non_ascii"),  # Non-ASCII letters preserved
+]
+
+
+@pytest.mark.parametrize("name, expected", SANITIZE_NAME_CASES)
 def test_sanitize_name(name, expected):
     # Act
     result = sanitize_name(name)
     # Assert
     assert result == expected
+
+
+@pytest.mark.parametrize(
+    "returncode, expected",
+    [(0, True), (1, False)],
+    ids=["success", "failure"],
+)
+def test_generate_libation_json(returncode, expected, tmp_path, mocker):
+    mock_run = mocker.patch("modules.utils.subprocess.run")
+    mock_run.return_value = subprocess.CompletedProcess(args=[], returncode=returncode, stderr="boom")
+    output_path = str(tmp_path / "libation.json")
+
+    with open(tmp_path / "test.log", "w") as log_file:
+        assert generate_libation_json(output_path, log_file) is expected
+
+    mock_run.assert_called_once_with(
+        ["libationcli", "export", "--path", output_path, "--json"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+
+
+def test_move_file_replaces_existing(tmp_path):
+    source = tmp_path / "source.m4b"
+    target = tmp_path / "target.m4b"
+    source.write_bytes(b"new")
+    target.write_bytes(b"old")
+
+    move_file(str(source), str(target))
+
+    assert not source.exists()
+    assert target.read_bytes() == b"new"
+
+
+def test_move_file_across_filesystems(tmp_path, mocker):
+    mocker.patch("modules.utils.os.replace", side_effect=OSError(errno.EXDEV, "Invalid cross-device link"))
+    mock_move = mocker.patch("modules.utils.shutil.move")
+
+    move_file(str(tmp_path / "source.m4b"), str(tmp_path / "target.m4b"))
+
+    mock_move.assert_called_once_with(str(tmp_path / "source.m4b"), str(tmp_path / "target.m4b"))
+
+
+@pytest.mark.parametrize(
+    "allow_hardlinks, expected_action",
+    [(True, "hardlinked"), (False, "copied")],
+    ids=["hardlink", "copy"],
+)
+def test_copy_file(allow_hardlinks, expected_action, tmp_path):
+    source = tmp_path / "source.m4b"
+    target = tmp_path / "target.m4b"
+    source.write_bytes(b"new")
+    target.write_bytes(b"old")
+
+    action = copy_file(str(source), str(target), allow_hardlinks)
+
+    assert action == expected_action
+    assert source.exists()
+    assert target.read_bytes() == b"new"
+    assert os.path.samefile(source, target) is allow_hardlinks
+
+
+def test_copy_file_hardlink_unsupported(tmp_path, mocker):
+    mocker.patch("modules.utils.os.link", side_effect=OSError(errno.EXDEV, "Invalid cross-device link"))
+    source = tmp_path / "source.m4b"
+    source.write_bytes(b"new")
+
+    assert copy_file(str(source), str(tmp_path / "target.m4b"), allow_hardlinks=True) == "copied"